@@ -0,0 +1,73 @@
+import os
+from flask import Response, abort, jsonify, request
+import change_detection
+import db_utils
+import instrumentation
+import snapshot
+from figure_cache import figure_cache
+from export import EXPORT_FORMATS, ExportError, build_export_query, iter_csv, iter_parquet, parquet_available
+
+
+# Rutas internas servidas directamente por Flask (app.server), fuera de Dash
+def register_routes(server):
+    instrumentation.register(server)
+
+    # Figura ya serializada de un gráfico del dashboard
+    @server.route('/_internal/figures/<chart_id>.json')
+    def figure_payload(chart_id):
+        entry = figure_cache.payload(chart_id)
+        if entry is None:
+            abort(404)
+        version, payload = entry
+        # La versión es la tupla de huellas de los datos: la misma ETag en todos los workers
+        etag = f'"{chart_id}-{"-".join(map(str, version))}"'
+        if request.headers.get('If-None-Match') == etag:
+            return Response(status=304)
+        return Response(payload, mimetype='application/json', headers={'ETag': etag})
+
+    # Tiempos de construcción frente a tiempos de servicio por gráfico
+    @server.route('/_internal/figures')
+    def figure_stats():
+        return jsonify(figure_cache.stats())
+
+    # Métricas internas de este proceso (pool, cachés, ejecutor de consultas)
+    @server.route('/_internal/metrics')
+    def metrics():
+        return jsonify({
+            'pid': os.getpid(),
+            'pool': db_utils.get_pool_stats(),
+            'query_cache': db_utils.query_cache.stats(),
+            'query_executor': db_utils.query_executor.stats(),
+            'snapshot': {'version': snapshot.snapshot.version, 'loaded_at': snapshot.snapshot.loaded_at},
+            'figures': figure_cache.stats(),
+            'changes': change_detection.change_detector.stats(),
+        })
+
+    # Histogramas de tiempo total, tiempo de base de datos y bytes por callback, y de tiempo por consulta
+    @server.route('/_internal/metrics/callbacks')
+    def callback_metrics():
+        return jsonify(instrumentation.metrics.snapshot())
+
+    # Últimas consultas lentas (más recientes primero) con su plan de ejecución
+    @server.route('/_internal/metrics/slow-queries')
+    def slow_queries():
+        return jsonify({'threshold_ms': instrumentation.metrics.slow_query_ms,
+                        'queries': instrumentation.metrics.slow_queries()})
+
+    # Exportación completa de una tabla con el filtro y orden de la página de tablas.
+    # Se envía en streaming: si el cliente se desconecta Werkzeug cierra el
+    # generador y con él el cursor y la conexión.
+    @server.route('/export/<table_name>.<fmt>')
+    def export_table(table_name, fmt):
+        if fmt not in EXPORT_FORMATS:
+            abort(404)
+        if fmt == 'parquet' and not parquet_available():
+            return Response("La exportación a Parquet necesita pyarrow (pip install pyarrow)", status=501)
+        try:
+            query, params, columns = build_export_query(table_name, request.args.get('filter', ''),
+                                                        request.args.get('sort', ''))
+        except ExportError:
+            abort(404)
+        chunks = iter_csv(query, params, columns) if fmt == 'csv' else iter_parquet(query, params, columns)
+        return Response(chunks, mimetype=EXPORT_FORMATS[fmt],
+                        headers={'Content-Disposition': f'attachment; filename="{table_name}.{fmt}"'})
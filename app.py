@@ -1,10 +1,18 @@
 import dash
 from dash import html, dcc
+import instrumentation
+# Antes de importar los módulos de datos, para no perder sus primeros registros
+instrumentation.setup_logging()
+import api
+import change_detection
 
 google_font_roboto = "https://fonts.googleapis.com/css2?family=Roboto:wght@400;700&display=swap"
 
 app = dash.Dash(__name__, use_pages=True, suppress_callback_exceptions=True, external_stylesheets=[google_font_roboto ,'assets/styles.css'])
 server = app.server
+api.register_routes(server)
+# Invalida cachés, conteos y gráficos cuando cambian los datos de una tabla
+change_detection.change_detector.start()
 
 app.layout = html.Div([
     html.Div([
@@ -0,0 +1,73 @@
+"""
+Compara la lectura con pd.read_sql + to_dict('records') frente a la lectura
+columnar por lotes de db_utils + frame_to_records (solo el DataFrame y el
+camino completo hasta los registros de dash_table), contra la base de datos
+configurada en .env. Uso:
+
+    python benchmarks/bench_fetch.py --query "SELECT * FROM city" --repeat 20
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from sqlalchemy import text
+import db_utils
+
+
+def pandas_frame(query):
+    return pd.read_sql(text(query), db_utils.engine)
+
+
+def columnar_frame(query):
+    return db_utils._read_columnar(text(query), {})
+
+
+def pandas_path(query):
+    df = pd.read_sql(text(query), db_utils.engine)
+    return df.to_dict('records')
+
+
+def columnar_path(query):
+    df = db_utils._read_columnar(text(query), {})
+    return db_utils.frame_to_records(df)
+
+
+def measure(fn, query, repeat):
+    fn(query)  # calentar conexiones del pool
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(query)
+        timings.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    fn(query)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'median_ms': statistics.median(timings), 'min_ms': min(timings), 'peak_mb': peak / 1024 / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--query', default='SELECT * FROM country')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    if db_utils.engine is None:
+        sys.exit("Error: El engine de SQLAlchemy no está inicializado.")
+
+    print(f"Query: {args.query} ({args.repeat} repeticiones)")
+    paths = (('read_sql (frame)', pandas_frame), ('columnar (frame)', columnar_frame),
+             ('read_sql + dict', pandas_path), ('columnar + json', columnar_path))
+    for name, fn in paths:
+        result = measure(fn, args.query, args.repeat)
+        print(f"  {name:17} mediana {result['median_ms']:8.2f} ms   mínimo {result['min_ms']:8.2f} ms   "
+              f"pico memoria {result['peak_mb']:7.2f} MB")
+
+
+if __name__ == '__main__':
+    main()
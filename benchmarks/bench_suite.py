@@ -0,0 +1,408 @@
+"""
+Suite de rendimiento de la aplicación completa sobre una base de datos local.
+
+Crea (y reutiliza) una base de datos SQLite embebida a partir de world.sql,
+opcionalmente con `city` multiplicada por --scale, y mide a través del
+servidor Flask de la app (como lo haría el navegador):
+
+  - cada callback de pages/dashboard.py, con la figura ya cacheada (warm) y
+    reconstruyéndola en cada llamada (cold),
+  - una interacción de filtro cruzado (los ocho gráficos con un continente
+    y/o países seleccionados), servida desde caché y reconstruida, y una
+    selección nueva en el mapa sobre las figuras sin filtro ya cacheadas,
+  - update_dynamic_table en primeras páginas, páginas profundas (salto
+    directo y página siguiente), ordenaciones y filtros,
+  - parse_filter_query_named_params y la generación de los layouts,
+
+con latencias p50/p95/p99, memoria máxima de cada escenario (tracemalloc),
+rendimiento con --clients clientes simultáneos y el RSS máximo del proceso.
+Los resultados se guardan en JSON para comparar ejecuciones. Uso:
+
+    python benchmarks/bench_suite.py --scale 100 --repeat 30 --clients 8
+    python benchmarks/bench_suite.py --compare resultados_antes.json resultados_despues.json
+"""
+import argparse
+import importlib
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+DATA_DIR = os.path.join(BENCH_DIR, '.data')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+PAGE_SIZE = 15
+
+sys.path.insert(0, ROOT_DIR)
+
+
+# Base de datos
+
+def seed_database(scale: int, rebuild: bool = False) -> str:
+    """Crea benchmarks/.data/world_x<scale>.db desde world.sql, con city multiplicada por `scale`."""
+    import embedded
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    db_path = os.path.join(DATA_DIR, f"world_x{scale}.db")
+    if os.path.exists(db_path) and not rebuild:
+        return db_path
+    temp_path = f"{db_path}.build"
+    embedded.build_from_dump(os.path.join(ROOT_DIR, 'world.sql'), temp_path)
+    if scale > 1:
+        connection = sqlite3.connect(temp_path)
+        id_step = connection.execute("SELECT MAX(ID) + 1 FROM city").fetchone()[0]
+        # Copias deterministas de cada ciudad con otro ID, nombre y población
+        connection.execute(f"""
+            INSERT INTO city (ID, Name, CountryCode, District, Population)
+            WITH RECURSIVE copies(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM copies WHERE n < {scale - 1})
+            SELECT c.ID + copies.n * {id_step}, c.Name || ' ' || copies.n, c.CountryCode, c.District,
+                   (c.Population + copies.n * 7919) % 10500000
+            FROM city c, copies
+        """)
+        connection.execute("ANALYZE")
+        connection.commit()
+        connection.close()
+    os.replace(temp_path, db_path)
+    return db_path
+
+
+# Escenarios
+
+def table_request(table_name, page=0, sort_by=None, filter_query=''):
+    table_id = {'type': 'dynamic-table', 'table': table_name}
+    return {
+        'output': '..{"table":["MATCH"],"type":"dynamic-table"}.data'
+                  '...{"table":["MATCH"],"type":"dynamic-table-row-count"}.children'
+                  '...{"table":["MATCH"],"type":"dynamic-table-export"}.children..',
+        'outputs': [{'id': table_id, 'property': 'data'},
+                    {'id': {'type': 'dynamic-table-row-count', 'table': table_name}, 'property': 'children'},
+                    {'id': {'type': 'dynamic-table-export', 'table': table_name}, 'property': 'children'}],
+        'inputs': [{'id': table_id, 'property': 'page_current', 'value': page},
+                   {'id': table_id, 'property': 'page_size', 'value': PAGE_SIZE},
+                   {'id': table_id, 'property': 'sort_by', 'value': sort_by or []},
+                   {'id': table_id, 'property': 'filter_query', 'value': filter_query}],
+        'state': [{'id': table_id, 'property': 'id', 'value': table_id}],
+        'changedPropIds': [],
+    }
+
+
+def open_table_request(table_name):
+    # Lo que envía el navegador al hacer clic en el Summary de la tabla
+    summary_id = {'type': 'dynamic-table-summary', 'table': table_name}
+    container_id = {'type': 'dynamic-table-container', 'table': table_name}
+    return {
+        'output': '..{"table":["MATCH"],"type":"dynamic-table-container"}.children'
+                  '...{"table":["MATCH"],"type":"dynamic-table-details"}.open..',
+        'outputs': [{'id': container_id, 'property': 'children'},
+                    {'id': {'type': 'dynamic-table-details', 'table': table_name}, 'property': 'open'}],
+        'inputs': [{'id': summary_id, 'property': 'n_clicks', 'value': 1}],
+        'state': [{'id': container_id, 'property': 'children', 'value': None},
+                  {'id': summary_id, 'property': 'id', 'value': summary_id}],
+        'changedPropIds': [json.dumps(summary_id, sort_keys=True, separators=(',', ':')) + '.n_clicks'],
+    }
+
+
+def figure_request(chart_id, filtro=None):
+    return {'output': f"{chart_id}.figure", 'outputs': {'id': chart_id, 'property': 'figure'},
+            'inputs': [{'id': 'dashboard-filter', 'property': 'data', 'value': filtro or {}}],
+            'changedPropIds': ['dashboard-filter.data'] if filtro else []}
+
+
+def post(client, body):
+    response = client.post('/_dash-update-component', json=body)
+    if response.status_code != 200:
+        raise RuntimeError(f"HTTP {response.status_code}: {response.data[:200]!r}")
+    return response
+
+
+def clear_data_caches():
+    import db_utils
+    import pagination
+    db_utils.query_cache.invalidate()
+    pagination.row_counter.invalidate()
+
+
+def build_scenarios(city_rows: int) -> list:
+    """Lista de escenarios: nombre, grupo, función medida y preparación opcional (no medida)."""
+    import db_utils
+    import snapshot
+    from figure_cache import figure_cache
+    # Los módulos de pages ya los cargó Dash al importar app
+    dashboard_page = importlib.import_module('pages.dashboard')
+    tables_page = importlib.import_module('pages.tables')
+
+    deep_page = max(city_rows // PAGE_SIZE // 2, 1)
+    population_desc = [{'column_id': 'Population', 'direction': 'desc'}]
+    scenarios = []
+
+    def add(name, group, run, setup=None, concurrent=False):
+        scenarios.append({'name': name, 'group': group, 'run': run, 'setup': setup, 'concurrent': concurrent})
+
+    chart_ids = ('graph-gnp-choropleth', 'graph-top-countries', 'graph-pop-continent-pie', 'graph-top-cities',
+                 'graph-language-dist', 'graph-lifeexp-vs-gnp', 'graph-govform-dist', 'graph-surface-continent')
+    for chart_id in chart_ids:
+        body = figure_request(chart_id)
+        add(f"dashboard:{chart_id}", 'dashboard', lambda c, b=body: post(c, b), concurrent=True)
+        add(f"dashboard:{chart_id}:cold", 'dashboard', lambda c, b=body: post(c, b),
+            setup=lambda c, chart=chart_id: figure_cache.invalidate(chart))
+
+    # Filtro cruzado: cada escenario sirve los ocho gráficos con el filtro (una interacción completa);
+    # :cold reconstruye todas las figuras desde el snapshot indexado
+    for name, filtro in (('continent', {'continents': ['Europe']}),
+                         ('countries', {'codes': ['ARG', 'BRA', 'CHN', 'ESP', 'IND', 'USA']}),
+                         ('continent_and_countries', {'continents': ['South America'], 'codes': ['ARG', 'BRA', 'CHL']})):
+        bodies = [figure_request(chart_id, filtro) for chart_id in chart_ids]
+        interaction = lambda c, bs=bodies: [post(c, b) for b in bs]
+        add(f"crossfilter:{name}", 'crossfilter', interaction, concurrent=True)
+        add(f"crossfilter:{name}:cold", 'crossfilter', interaction, setup=lambda c: figure_cache.invalidate())
+
+    # Selección en el mapa nunca vista (cada repetición elige otros países): las figuras sin
+    # filtro siguen cacheadas y las ocho variantes se construyen parcheándolas
+    country_codes = sorted(snapshot.snapshot.get('country')['Code'])
+    selections = random.Random(0)
+    base_bodies = [figure_request(chart_id) for chart_id in chart_ids]
+
+    def map_selection(c):
+        filtro = {'codes': sorted(selections.sample(country_codes, 25))}
+        return [post(c, figure_request(chart_id, filtro)) for chart_id in chart_ids]
+    add("crossfilter:map_selection:cold", 'crossfilter', map_selection,
+        setup=lambda c: [post(c, b) for b in base_bodies])
+
+    tables = [
+        ('first_page', dict(page=0)),
+        ('next_page', dict(page=1)),
+        ('deep_jump', dict(page=deep_page)),
+        ('deep_next', dict(page=deep_page + 1)),
+        ('sort_population_desc', dict(page=0, sort_by=population_desc)),
+        ('sort_population_desc_deep', dict(page=deep_page, sort_by=population_desc)),
+        # Tal como lo envía dash_table con filter_options={'case': 'insensitive'}
+        ('filter_name_contains', dict(page=0, filter_query='{Name} icontains san')),
+        ('filter_population_range', dict(page=0, filter_query='{Population} > 100000 && {Population} <= 500000')),
+        ('filter_and_sort', dict(page=2, sort_by=population_desc, filter_query='{CountryCode} = "USA"')),
+    ]
+    for name, kwargs in tables:
+        body = table_request('city', **kwargs)
+        setup = lambda c: clear_data_caches()
+        if name in ('next_page', 'deep_next'):
+            # La página anterior ya servida deja el cursor para la búsqueda por clave
+            previous = table_request('city', page=kwargs['page'] - 1)
+            setup = lambda c, prev=previous: (clear_data_caches(), post(c, prev), clear_data_caches())
+        add(f"tables:city:{name}", 'tables', lambda c, b=body: post(c, b), setup=setup)
+    add("tables:country:first_page", 'tables', lambda c, b=table_request('country'): post(c, b),
+        setup=lambda c: clear_data_caches())
+
+    city = db_utils.schema_catalog.get('city')
+    for name, filter_query in (('simple', '{Population} > 1000000'),
+                               ('compound', '({Name} scontains "San" || {District} contains "a") && {Population} >= 5000'),
+                               ('invalid', '{Nope} = 3 && {Population} is odd')):
+        add(f"filter:{name}", 'filter',
+            lambda c, q=filter_query: db_utils.parse_filter_query_named_params(q, city.columns, city.types))
+
+    add("layout:tables", 'layout', lambda c: tables_page.create_dynamic_layout())
+    add("layout:tables:open_city", 'layout', lambda c, b=open_table_request('city'): post(c, b))
+    add("layout:dashboard", 'layout', lambda c: dashboard_page.layout())
+    add("layout:http", 'layout', lambda c: c.get('/_dash-layout'))
+
+    # Mezcla para clientes simultáneos: páginas distintas para no servir todo desde caché
+    add("concurrent:tables", 'tables', None, concurrent=True)
+    return scenarios
+
+
+def concurrent_table_request(i: int, city_rows: int):
+    pages_total = max(city_rows // PAGE_SIZE, 1)
+    sort_by = [{'column_id': 'Population', 'direction': 'desc'}] if i % 3 == 0 else None
+    return table_request('city', page=(i * 37) % pages_total, sort_by=sort_by)
+
+
+# Medición
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Percentil por rango más cercano sobre valores ya ordenados."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(timings_ms: list) -> dict:
+    values = sorted(timings_ms)
+    return {'n': len(values), 'mean_ms': sum(values) / len(values) if values else 0.0,
+            'min_ms': values[0] if values else 0.0, 'max_ms': values[-1] if values else 0.0,
+            'p50_ms': percentile(values, 0.50), 'p95_ms': percentile(values, 0.95), 'p99_ms': percentile(values, 0.99)}
+
+
+def measure(scenario, client, repeat: int) -> dict:
+    run, setup = scenario['run'], scenario['setup']
+    if setup: setup(client)
+    run(client)  # calentamiento
+    timings = []
+    for _ in range(repeat):
+        if setup: setup(client)
+        start = time.perf_counter()
+        run(client)
+        timings.append((time.perf_counter() - start) * 1000)
+    if setup: setup(client)
+    tracemalloc.start()
+    run(client)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {**summarize(timings), 'peak_mb': peak / 1024 / 1024}
+
+
+def measure_concurrency(server, scenarios, city_rows: int, clients: int, duration: float) -> dict:
+    """`clients` hilos repiten la mezcla de peticiones durante `duration` segundos."""
+    mix = [s for s in scenarios if s['concurrent']]
+    counter = itertools.count()
+    timings, errors = [], []
+    lock = threading.Lock()
+    # Calentamiento fuera de la medida: snapshot, figuras y conexiones del pool
+    client = server.test_client()
+    for scenario in mix:
+        if scenario['run'] is not None:
+            scenario['run'](client)
+
+    def worker():
+        client = server.test_client()
+        local = []
+        while time.perf_counter() < deadline:
+            i = next(counter)
+            scenario = mix[i % len(mix)]
+            start = time.perf_counter()
+            try:
+                if scenario['run'] is None:
+                    post(client, concurrent_table_request(i, city_rows))
+                else:
+                    scenario['run'](client)
+            except Exception as e:
+                with lock: errors.append(str(e))
+                continue
+            local.append((time.perf_counter() - start) * 1000)
+        with lock: timings.extend(local)
+
+    deadline = time.perf_counter() + duration
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    elapsed = time.perf_counter() - start
+    return {'clients': clients, 'duration_s': elapsed, 'requests': len(timings), 'errors': len(errors),
+            'error_samples': errors[:5],
+            'throughput_rps': len(timings) / elapsed if elapsed else 0.0, **summarize(timings)}
+
+
+def run_suite(args) -> dict:
+    db_path = seed_database(args.scale, args.rebuild)
+    os.environ['DB_BACKEND'] = 'sqlite'
+    os.environ['DB_SQLITE_PATH'] = db_path
+    os.environ['SNAPSHOT_REFRESH_SECONDS'] = '0'
+    os.environ['DASHBOARD_PREWARM_FILTERS'] = 'false'  # los escenarios :cold miden la construcción
+    os.environ.setdefault('LOG_LEVEL', 'ERROR')  # el log de la app no se mezcla con los resultados
+    os.chdir(ROOT_DIR)
+    import app as dash_app
+    server = dash_app.server
+    client = server.test_client()
+    with sqlite3.connect(db_path) as connection:
+        city_rows = connection.execute("SELECT COUNT(*) FROM city").fetchone()[0]
+
+    scenarios = build_scenarios(city_rows)
+    results = {}
+    for scenario in scenarios:
+        if scenario['run'] is None or (args.only and not scenario['name'].startswith(tuple(args.only))):
+            continue
+        results[scenario['name']] = measure(scenario, client, args.repeat)
+        r = results[scenario['name']]
+        print(f"{scenario['name']:<48} p50 {r['p50_ms']:8.2f} ms  p95 {r['p95_ms']:8.2f} ms  "
+              f"p99 {r['p99_ms']:8.2f} ms  pico {r['peak_mb']:7.2f} MB")
+
+    concurrency = None
+    if args.clients > 0:
+        concurrency = measure_concurrency(server, scenarios, city_rows, args.clients, args.duration)
+        print(f"{args.clients} clientes: {concurrency['throughput_rps']:.1f} peticiones/s, "
+              f"p50 {concurrency['p50_ms']:.2f} ms, p99 {concurrency['p99_ms']:.2f} ms, errores {concurrency['errors']}")
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git_commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'scale': args.scale,
+            'city_rows': city_rows,
+            'repeat': args.repeat,
+            'settings': {name: os.getenv(name) for name in ('FETCH_ENGINE', 'TABLE_PAGINATION', 'CACHE_TTL',
+                                                            'QUERY_WORKERS', 'DB_POOL_SIZE') if os.getenv(name)},
+        },
+        'scenarios': results,
+        'concurrency': concurrency,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def compare(base_path: str, new_path: str, threshold: float) -> int:
+    """Compara dos ficheros de resultados; devuelve 1 si algún p50/p95 empeora más de `threshold`."""
+    with open(base_path) as f: base = json.load(f)
+    with open(new_path) as f: new = json.load(f)
+    regressions = 0
+    print(f"{'escenario':<48} {'p50 antes':>10} {'p50 ahora':>10} {'cambio':>8}   {'p95 antes':>10} {'p95 ahora':>10} {'cambio':>8}")
+    for name in sorted(set(base['scenarios']) | set(new['scenarios'])):
+        before, after = base['scenarios'].get(name), new['scenarios'].get(name)
+        if before is None or after is None:
+            print(f"{name:<48} {'(solo en ' + ('la nueva' if before is None else 'la base') + ')':>10}")
+            continue
+        cells, flagged = [], False
+        for metric in ('p50_ms', 'p95_ms'):
+            change = (after[metric] - before[metric]) / before[metric] if before[metric] else 0.0
+            flagged = flagged or change > threshold
+            cells.append(f"{before[metric]:10.2f} {after[metric]:10.2f} {change:+8.1%}")
+        regressions += flagged
+        print(f"{name:<48} {'   '.join(cells)}{'  <-- peor' if flagged else ''}")
+    if base.get('concurrency') and new.get('concurrency'):
+        print(f"Rendimiento concurrente: {base['concurrency']['throughput_rps']:.1f} -> "
+              f"{new['concurrency']['throughput_rps']:.1f} peticiones/s")
+    print(f"{regressions} escenarios empeoran más de un {threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=int, default=1, help='multiplicador de filas de city (p. ej. 100)')
+    parser.add_argument('--repeat', type=int, default=20, help='repeticiones medidas por escenario')
+    parser.add_argument('--clients', type=int, default=4, help='clientes simultáneos (0 = no medir)')
+    parser.add_argument('--duration', type=float, default=10.0, help='segundos de la prueba concurrente')
+    parser.add_argument('--only', nargs='*', help='prefijos de escenarios a medir (p. ej. tables: filter:)')
+    parser.add_argument('--rebuild', action='store_true', help='volver a crear la base de datos de prueba')
+    parser.add_argument('--output', help='fichero JSON de resultados (por defecto benchmarks/results/<fecha>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NUEVO'), help='comparar dos ficheros de resultados')
+    parser.add_argument('--threshold', type=float, default=0.10, help='empeoramiento tolerado al comparar (0.10 = 10%%)')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(*args.compare, args.threshold))
+
+    results = run_suite(args)
+    output = args.output or os.path.join(RESULTS_DIR, f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"RSS máximo {results['max_rss_mb']:.1f} MB. Resultados guardados en {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from sqlalchemy import text
+import db_utils
+import snapshot
+from pagination import paginator, row_counter
+
+logger = logging.getLogger(__name__)
+
+# Segundos entre comprobaciones de cambios (0 desactiva la detección)
+CHANGE_POLL_SECONDS = int(os.getenv('CHANGE_POLL_SECONDS', '30'))
+# CHECKSUM TABLE detecta también los UPDATE que no cambian el número de filas,
+# pero en InnoDB lee la tabla completa: solo para tablas pequeñas
+CHANGE_DETECTION_CHECKSUM = os.getenv('CHANGE_DETECTION_CHECKSUM', 'false').lower() in ('1', 'true', 'yes')
+# Tablas vigiladas separadas por comas (vacío = todas las del catálogo)
+CHANGE_DETECTION_TABLES = [t.strip() for t in os.getenv('CHANGE_DETECTION_TABLES', '').split(',') if t.strip()]
+
+DATABASE_SIGNATURE = '*'  # huella de toda la base de datos cuando el motor no la da por tabla
+
+
+class ChangeDetector:
+    """
+    Comprueba periódicamente una huella barata de cada tabla y mantiene un
+    vector de versiones (tabla -> versión). Cuando una huella cambia, avisa a
+    los suscriptores con el conjunto de tablas modificadas para que descarten
+    solo lo que depende de ellas.
+
+    Huellas: en MariaDB, UPDATE_TIME de information_schema.TABLES (una sola
+    consulta para todas las tablas), con COUNT(*)/MAX(clave primaria) cuando
+    el motor no lo mantiene y, opcionalmente, CHECKSUM TABLE. En SQLite,
+    PRAGMA data_version sobre una conexión propia dice si otra conexión ha
+    confirmado cambios; solo entonces se calculan las huellas por tabla, y si
+    ninguna cambió (un UPDATE que no altera el conteo ni la clave máxima) se
+    consideran cambiadas todas.
+    """
+    def __init__(self, poll_seconds: int = CHANGE_POLL_SECONDS, use_checksum: bool = CHANGE_DETECTION_CHECKSUM,
+                 tables=None):
+        self.poll_seconds = poll_seconds
+        self.use_checksum = use_checksum
+        self.watched_tables = list(tables if tables is not None else CHANGE_DETECTION_TABLES)
+        self.versions = {}
+        self.polls = 0
+        self.changes = 0
+        self.last_poll = None
+        self.last_change = None
+        self.last_error = None
+        self._fingerprints = None
+        self._listeners = []
+        self._sqlite_connection = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, listener):
+        """`listener(tablas_cambiadas: set)` se llama tras cada cambio detectado."""
+        self._listeners.append(listener)
+
+    def version_vector(self) -> dict:
+        with self._lock:
+            return dict(self.versions)
+
+    def poll(self) -> set:
+        """Compara las huellas actuales con las anteriores y devuelve las tablas cambiadas."""
+        fingerprints = self._read_fingerprints()
+        with self._lock:
+            previous, self._fingerprints = self._fingerprints, fingerprints
+            self.polls += 1
+            self.last_poll = time.time()
+            if previous is None:
+                # Primera lectura: solo establece la referencia
+                self.versions = {table: 0 for table in fingerprints if table != DATABASE_SIGNATURE}
+                return set()
+            tables = (set(previous) | set(fingerprints)) - {DATABASE_SIGNATURE}
+            changed = {table for table in tables if previous.get(table) != fingerprints.get(table)}
+            if not changed and DATABASE_SIGNATURE in previous \
+                    and previous[DATABASE_SIGNATURE] != fingerprints.get(DATABASE_SIGNATURE):
+                changed = set(tables)
+            for table in changed:
+                self.versions[table] = self.versions.get(table, 0) + 1
+            if changed:
+                self.changes += 1
+                self.last_change = self.last_poll
+        if changed:
+            logger.info("Cambios detectados en %s", ", ".join(sorted(changed)),
+                        extra={'tables': sorted(changed), 'versions': self.version_vector()})
+            for listener in self._listeners:
+                try:
+                    listener(changed)
+                except Exception as e:
+                    logger.exception("Error al invalidar tras un cambio en %s: %s", sorted(changed), e)
+        return changed
+
+    def start(self):
+        """Arranca la comprobación periódica en un hilo de fondo (si está activada)."""
+        if self.poll_seconds <= 0 or db_utils.engine is None:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._poll_loop, name='change-detector', daemon=True)
+            self._thread.start()
+
+    def stop(self, wait: bool = False):
+        self._stop.set()
+        thread = self._thread
+        if wait and thread is not None and thread.is_alive():
+            thread.join()
+
+    def reset_after_fork(self):
+        """
+        Arranca la comprobación en un worker creado con fork. Las huellas
+        heredadas se conservan como referencia, así que la primera comprobación
+        del worker ya detecta lo que cambió desde que el proceso padre cargó
+        los datos. La conexión SQLite heredada no se puede usar en el hijo, y
+        su data_version no es comparable con la de una conexión nueva, así que
+        esa primera vez solo cuentan las huellas por tabla.
+        """
+        if self._fingerprints is not None:
+            self._fingerprints = {name: value for name, value in self._fingerprints.items()
+                                  if name != DATABASE_SIGNATURE}
+        self._sqlite_connection = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'poll_seconds': self.poll_seconds, 'polls': self.polls, 'changes': self.changes,
+                    'last_poll': self.last_poll, 'last_change': self.last_change,
+                    'last_error': self.last_error, 'versions': dict(self.versions)}
+
+    def _poll_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+                self.last_error = None
+            except Exception as e:
+                # Si la base de datos no responde se reintenta en la siguiente vuelta
+                self.last_error = str(e)
+                logger.warning("Error al comprobar cambios en los datos: %s", e)
+            self._stop.wait(self.poll_seconds)
+
+    def _tables(self) -> dict:
+        tables = db_utils.schema_catalog.tables()
+        if self.watched_tables:
+            return {name: info for name, info in tables.items() if name in self.watched_tables}
+        return tables
+
+    def _read_fingerprints(self) -> dict:
+        engine = db_utils.engine
+        if engine.dialect.name == 'sqlite':
+            return self._sqlite_fingerprints(engine)
+        tables = self._tables()
+        fingerprints = {}
+        with engine.connect() as connection:
+            rows = connection.execute(text(
+                "SELECT TABLE_NAME, UPDATE_TIME FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE()"))
+            update_times = {name: update_time for name, update_time in rows}
+            if self.use_checksum and tables:
+                checksum_sql = "CHECKSUM TABLE " + ", ".join(f"`{name}`" for name in tables)
+                checksums = {name.split('.')[-1]: checksum for name, checksum in connection.execute(text(checksum_sql))}
+            else:
+                checksums = {}
+            for name, info in tables.items():
+                update_time = update_times.get(name)
+                if update_time is None and name not in checksums:
+                    fingerprints[name] = _count_fingerprint(connection, name, info)
+                else:
+                    fingerprints[name] = (update_time, checksums.get(name))
+        return fingerprints
+
+    def _sqlite_fingerprints(self, engine) -> dict:
+        if self._sqlite_connection is None:
+            # data_version solo cambia con escrituras de otras conexiones, así que esta no se comparte
+            self._sqlite_connection = sqlite3.connect(engine.url.database, check_same_thread=False)
+        signature = self._sqlite_connection.execute("PRAGMA data_version").fetchone()[0]
+        with self._lock:
+            previous = self._fingerprints
+        if previous is not None and previous.get(DATABASE_SIGNATURE) == signature:
+            return previous
+        fingerprints = {DATABASE_SIGNATURE: signature}
+        with engine.connect() as connection:
+            for name, info in self._tables().items():
+                fingerprints[name] = _count_fingerprint(connection, name, info)
+        return fingerprints
+
+
+def _count_fingerprint(connection, table_name, info):
+    primary_key = info.primary_key[:1]
+    max_sql = f", MAX(`{primary_key[0]}`)" if primary_key else ""
+    return tuple(connection.execute(text(f"SELECT COUNT(*){max_sql} FROM `{table_name}`")).one())
+
+
+def invalidate_dependents(tables: set):
+    """Descarta los resultados, conteos y cursores de las tablas cambiadas y recarga su parte del snapshot."""
+    removed = db_utils.query_cache.invalidate_tables(tables)
+    for table in tables:
+        row_counter.invalidate(table)
+        paginator.invalidate(table)
+    # Las figuras dependen de la versión de cada tabla del snapshot, así que
+    # solo se reconstruyen las de los gráficos que usan las tablas recargadas
+    if snapshot.snapshot.frames and set(tables) & set(snapshot.SNAPSHOT_QUERIES):
+        snapshot.snapshot.refresh(tables)
+    logger.info("Invalidadas %d consultas cacheadas por cambios en %s", removed, ", ".join(sorted(tables)))
+
+
+change_detector = ChangeDetector()
+change_detector.subscribe(invalidate_dependents)
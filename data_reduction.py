@@ -0,0 +1,177 @@
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Tamaño máximo aproximado (bytes) de los datos de cada figura enviada al navegador
+FIGURE_BYTE_BUDGET = int(os.getenv('FIGURE_BYTE_BUDGET', '500000'))
+# Presupuestos por gráfico: "graph-lifeexp-vs-gnp=200000,graph-gnp-choropleth=1000000"
+FIGURE_BYTE_BUDGETS = {
+    chart_id.strip(): int(size)
+    for chart_id, _, size in (item.partition('=') for item in os.getenv('FIGURE_BYTE_BUDGETS', '').split(','))
+    if chart_id.strip() and size.strip()
+}
+# Reducción de los diagramas de dispersión que superan el presupuesto: 'bin' (rejilla 2D) o 'lttb'
+FIGURE_SCATTER_REDUCTION = os.getenv('FIGURE_SCATTER_REDUCTION', 'bin').lower()
+
+# Plotly serializa los arrays numéricos en base64 (8 bytes -> ~11 caracteres)
+NUMERIC_BYTES = 11
+SAMPLE_ROWS = 1000
+
+
+def budget_for(chart_id: str) -> int:
+    return FIGURE_BYTE_BUDGETS.get(chart_id, FIGURE_BYTE_BUDGET)
+
+
+def bytes_per_row(df: pd.DataFrame, columns) -> float:
+    """Estimación de lo que ocupa cada fila de `columns` en el JSON de la figura (sobre una muestra)."""
+    sample = df.head(SAMPLE_ROWS)
+    total = 0.0
+    for col in columns:
+        if pd.api.types.is_numeric_dtype(sample[col]):
+            total += NUMERIC_BYTES
+        elif not sample.empty:
+            total += sample[col].astype(str).str.len().mean() + 3  # comillas y coma
+    return max(total, 1.0)
+
+
+def max_rows(df: pd.DataFrame, columns, budget: int) -> int:
+    """Filas que caben en `budget` bytes."""
+    return max(int(budget // bytes_per_row(df, columns)), 1)
+
+
+def reduce_scatter(df: pd.DataFrame, x: str, y: str, budget: int, group: str = None, size: str = None,
+                   label: str = None, log_x: bool = False, log_y: bool = False) -> pd.DataFrame:
+    """
+    Devuelve `df` sin tocar si cabe en el presupuesto. Si no, lo reduce con
+    FIGURE_SCATTER_REDUCTION: 'bin' agrupa los puntos en una rejilla 2D
+    (bin_scatter) y 'lttb' conserva los puntos que mejor mantienen la forma
+    de y frente a x (lttb_indices), repartidos entre los grupos de color.
+    """
+    columns = [c for c in (x, y, group, size, label) if c]
+    limit = max_rows(df, columns, budget)
+    if len(df) <= limit:
+        return df
+    if FIGURE_SCATTER_REDUCTION == 'lttb':
+        reduced = _lttb_by_group(df, x, y, limit, group)
+    else:
+        reduced = bin_scatter(df, x, y, limit, group=group, size=size, label=label, log_x=log_x, log_y=log_y)
+    logger.info("Dispersión reducida de %d a %d puntos (%s, presupuesto %d bytes)",
+                len(df), len(reduced), FIGURE_SCATTER_REDUCTION, budget)
+    return reduced
+
+
+def bin_scatter(df: pd.DataFrame, x: str, y: str, max_points: int, group: str = None, size: str = None,
+                label: str = None, log_x: bool = False, log_y: bool = False) -> pd.DataFrame:
+    """
+    Agrupa los puntos en una rejilla regular de x por y (en escala logarítmica
+    si el eje lo es) y devuelve un punto por celda y grupo: la media de x e y,
+    la suma de `size`, el número de puntos ('Points') y como `label` el
+    nombre original si la celda tiene un solo punto o "N puntos" si no.
+    """
+    groups = df[group].nunique() if group else 1
+    bins = max(int(np.sqrt(max_points / max(groups, 1))), 2)
+    x_values = _axis_values(df[x], log_x)
+    y_values = _axis_values(df[y], log_y)
+    cell = _bin_index(x_values, bins) * bins + _bin_index(y_values, bins)
+
+    binned = pd.DataFrame({'_x': x_values, '_y': y_values, '_cell': cell}, index=df.index)
+    keys = ['_cell']
+    aggregations = {x: ('_x', 'mean'), y: ('_y', 'mean'), 'Points': ('_cell', 'size')}
+    if group:
+        binned[group] = df[group]
+        keys.insert(0, group)
+    if size:
+        binned['_size'] = df[size]
+        aggregations[size] = ('_size', 'sum')
+    if label:
+        binned['_label'] = df[label]
+        aggregations[label] = ('_label', 'first')
+    result = binned.groupby(keys, observed=True, sort=False).agg(**aggregations).reset_index()
+    if log_x: result[x] = 10 ** result[x]
+    if log_y: result[y] = 10 ** result[y]
+    if label:
+        result[label] = np.where(result['Points'] > 1, result['Points'].astype(str) + " puntos", result[label])
+    return result.drop(columns='_cell')
+
+
+def lttb_indices(x, y, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: posiciones de `threshold` puntos de la
+    serie (x ordenada) que conservan su forma visual. Cada cubo se resuelve
+    con operaciones vectorizadas de numpy.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if threshold >= n or n <= 2:
+        return np.arange(n)
+    if threshold < 3:
+        return np.array([0, n - 1][:max(threshold, 1)])
+    every = (n - 2) / (threshold - 2)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def top_n_with_other(df: pd.DataFrame, label: str, value: str, budget: int, other_label: str = 'Otros',
+                     keep: int = None) -> pd.DataFrame:
+    """
+    Barras: si hay más categorías de las que caben en el presupuesto (o más
+    de `keep`), conserva las de mayor `value` y suma el resto en una barra
+    `other_label`. El presupuesto solo puede dejar menos de `keep`.
+    """
+    limit = max_rows(df, [label, value], budget)
+    size = len(df) if len(df) <= limit else limit - 1
+    if keep is not None:
+        size = min(size, keep)
+    if size >= len(df):
+        return df
+    ordered = df.sort_values(value, ascending=False)
+    top = ordered.head(max(size, 1))
+    other = pd.DataFrame({label: [other_label], value: [ordered[value].iloc[len(top):].sum()]})
+    logger.info("Barras reducidas de %d a %d categorías (presupuesto %d bytes)", len(df), len(top) + 1, budget)
+    return pd.concat([top[[label, value]], other], ignore_index=True)
+
+
+def limit_rows(df: pd.DataFrame, value: str, columns, budget: int) -> pd.DataFrame:
+    """Mapas y otras figuras sin agregación posible: las filas de mayor `value` que caben en el presupuesto."""
+    limit = max_rows(df, columns, budget)
+    if len(df) <= limit:
+        return df
+    logger.info("Figura limitada a %d de %d filas (presupuesto %d bytes)", limit, len(df), budget)
+    return df.nlargest(limit, value)
+
+
+def _lttb_by_group(df, x, y, limit, group):
+    # Cada grupo de color recibe una parte del límite proporcional a sus filas
+    parts = df.groupby(group, observed=True, sort=False) if group else [(None, df)]
+    selected = []
+    for _, part in parts:
+        part = part.sort_values(x)
+        threshold = max(int(limit * len(part) / len(df)), 3)
+        selected.append(part.iloc[lttb_indices(part[x].to_numpy(), part[y].to_numpy(), threshold)])
+    return pd.concat(selected)
+
+
+def _axis_values(values: pd.Series, log: bool) -> np.ndarray:
+    values = values.to_numpy(dtype=float)
+    return np.log10(values) if log else values
+
+
+def _bin_index(values: np.ndarray, bins: int) -> np.ndarray:
+    low, high = np.nanmin(values), np.nanmax(values)
+    if high <= low:
+        return np.zeros(len(values), dtype=np.int64)
+    return np.clip(((values - low) / (high - low) * bins).astype(np.int64), 0, bins - 1)
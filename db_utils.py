@@ -1,33 +1,759 @@
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import QueuePool
 import os
+import contextvars
+import hashlib
+import logging
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from dotenv import load_dotenv
 from sqlalchemy.exc import SQLAlchemyError
+from filter_compiler import FilterCompiler
+import embedded
+import instrumentation
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DB_HOST = os.getenv('DB_HOST')
 DB_USER = os.getenv('DB_USER')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
 DB_NAME = os.getenv('DB_NAME')
-DB_PORT = int(os.getenv('DB_PORT'))
+DB_PORT = int(os.getenv('DB_PORT') or '3306')
 
 MARIADB_URI = f"mariadb+mariadbconnector://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+# 'mariadb' (por defecto) o 'sqlite': motor embebido en un fichero local, creado desde DB_SQLITE_SOURCE si no existe
+DB_BACKEND = os.getenv('DB_BACKEND', 'mariadb').lower()
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_SQLITE_PATH = os.path.join(BASE_DIR, os.getenv('DB_SQLITE_PATH', 'world.db'))
+DB_SQLITE_SOURCE = os.path.join(BASE_DIR, os.getenv('DB_SQLITE_SOURCE', 'world.sql'))
+
+# Pool de conexiones
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))    # segundos esperando una conexión libre
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))    # reabrir conexiones más viejas que esto
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+
+
+class PoolStats:
+    """Contadores del pool de conexiones de este proceso."""
+    def __init__(self, rate_window: float = 60.0):
+        self.rate_window = rate_window
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.waits = 0              # peticiones que encontraron el pool agotado
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.connections_created = 0
+        self.invalidations = 0
+        self._created_at = deque()  # instantes de creación recientes, para la tasa
+
+    def record_checkout(self, seconds: float, waited: bool):
+        with self._lock:
+            self.checkouts += 1
+            if waited:
+                self.waits += 1
+                self.wait_time_total += seconds
+                self.wait_time_max = max(self.wait_time_max, seconds)
+
+    def record_connect(self):
+        now = time.monotonic()
+        with self._lock:
+            self.connections_created += 1
+            self._created_at.append(now)
+            while self._created_at and now - self._created_at[0] > self.rate_window:
+                self._created_at.popleft()
+
+    def record_invalidate(self):
+        with self._lock:
+            self.invalidations += 1
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            recent = sum(1 for t in self._created_at if now - t <= self.rate_window)
+            return {'checkouts': self.checkouts, 'waits': self.waits,
+                    'wait_time_total_s': self.wait_time_total, 'wait_time_max_s': self.wait_time_max,
+                    'connections_created': self.connections_created,
+                    'connections_created_per_min': recent * 60.0 / self.rate_window,
+                    'invalidations': self.invalidations}
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool que mide cuánto esperan las peticiones cuando no quedan conexiones libres."""
+    def _do_get(self):
+        max_overflow = getattr(self, '_max_overflow', 0)
+        exhausted = self.checkedin() == 0 and max_overflow != -1 and self.overflow() >= max_overflow
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_stats.record_checkout(time.perf_counter() - start, exhausted)
+
+
+def get_pool_stats() -> dict:
+    """Estado del pool (conexiones en uso, libres, desbordadas) más los contadores acumulados."""
+    if engine is None: return {}
+    pool = engine.pool
+    state = {'pid': os.getpid(), 'pool_class': type(pool).__name__}
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        if hasattr(pool, name):
+            state[name] = getattr(pool, name)()
+    return {**state, **pool_stats.snapshot()}
+
+
+def _create_engine():
+    if DB_BACKEND == 'sqlite':
+        if not os.path.exists(DB_SQLITE_PATH):
+            embedded.build_from_dump(DB_SQLITE_SOURCE, DB_SQLITE_PATH)
+        # Mismo pool que con MariaDB: cada hilo usa su propia conexión al fichero
+        sqlite_engine = create_engine(f"sqlite:///{DB_SQLITE_PATH}",
+                                      poolclass=InstrumentedQueuePool,
+                                      pool_size=DB_POOL_SIZE,
+                                      max_overflow=DB_MAX_OVERFLOW,
+                                      pool_timeout=DB_POOL_TIMEOUT,
+                                      connect_args={'check_same_thread': False})
+        event.listen(sqlite_engine, 'connect', embedded.configure_connection)
+        return sqlite_engine, f"SQLite {DB_SQLITE_PATH}"
+    return create_engine(MARIADB_URI,
+                         poolclass=InstrumentedQueuePool,
+                         pool_size=DB_POOL_SIZE,
+                         max_overflow=DB_MAX_OVERFLOW,
+                         pool_timeout=DB_POOL_TIMEOUT,
+                         pool_recycle=DB_POOL_RECYCLE,
+                         pool_pre_ping=DB_POOL_PRE_PING), f"{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+
 try:
-    engine = create_engine(MARIADB_URI)
-    print(f"SQLAlchemy engine creado para {DB_HOST}:{DB_PORT}/{DB_NAME}")
+    engine, engine_description = _create_engine()
+    event.listen(engine, 'connect', lambda dbapi_connection, connection_record: pool_stats.record_connect())
+    event.listen(engine, 'invalidate', lambda dbapi_connection, connection_record, exception: pool_stats.record_invalidate())
+    logger.info("SQLAlchemy engine creado para %s (pool %d+%d)", engine_description, DB_POOL_SIZE, DB_MAX_OVERFLOW)
 except ImportError:
-    print("Error: El conector 'mariadb' no está instalado. Ejecuta: pip install mariadb")
+    logger.error("El conector 'mariadb' no está instalado. Ejecuta: pip install mariadb")
     engine = None
 except Exception as e:
-    print(f"Error al crear el engine de SQLAlchemy: {e}")
+    logger.error("Error al crear el engine de SQLAlchemy: %s", e)
     engine = None
 
 
-def fetch_data(query: str, params: dict = None) -> pd.DataFrame:
+# Caché de resultados de consultas
+CACHE_TTL = int(os.getenv('CACHE_TTL', '300'))  # segundos por defecto que vive un resultado
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '512'))
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+# 'memory' (un caché por proceso) o 'sqlite' (fichero local compartido por todos los workers)
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory').lower()
+# Por defecto en un directorio propio de la aplicación (0700), nunca en uno compartido como /tmp
+CACHE_PATH = os.getenv('CACHE_PATH', os.path.join(BASE_DIR, '.cache', 'dash_world_cache.db'))
+CACHE_BUSY_TIMEOUT = float(os.getenv('CACHE_BUSY_TIMEOUT', '5'))  # segundos esperando el bloqueo de escritura
+
+
+class MemoryCacheBackend:
+    """
+    Backend de caché en memoria del proceso. Expulsa por LRU cuando se supera
+    el número máximo de entradas o de bytes, y descarta las entradas caducadas.
+    Cada entrada puede llevar las tablas de las que depende (delete_tables).
+    """
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()  # key -> (expira_en, tamaño, valor, tablas)
+        self._tables = {}  # tabla -> claves de las entradas que dependen de ella
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, size, value, _ = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._data.move_to_end(key)  # marcar como usado recientemente
+            return value
+
+    def set(self, key, value, ttl: float, size: int = 0, tables=()):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + ttl, size, value, tuple(tables))
+            for table in tables:
+                self._tables.setdefault(table, set()).add(key)
+            self._bytes += size
+            # Expulsar las entradas menos usadas hasta volver a los límites
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def delete_tables(self, tables) -> int:
+        """Descarta las entradas que dependen de alguna de `tables`; devuelve cuántas."""
+        with self._lock:
+            keys = set()
+            for table in tables:
+                keys |= self._tables.get(table, set())
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tables.clear()
+            self._bytes = 0
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._data.keys())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'backend': 'memory', 'entries': len(self._data), 'bytes': self._bytes, 'evictions': self.evictions}
+
+    def _remove(self, key):
+        _, size, _, tables = self._data.pop(key)
+        self._bytes -= size
+        for table in tables:
+            keys = self._tables.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tables[table]
+
+
+class SQLiteCacheBackend:
+    """
+    Backend de caché compartido entre procesos: un fichero SQLite local en
+    modo WAL al que acceden todos los workers (lecturas concurrentes, una
+    escritura a la vez). Mismo contrato que MemoryCacheBackend con claves de
+    texto; los valores se guardan como texto o JSON (ver _encode_cache_value),
+    nunca con un formato que ejecute código al leerlo. El fichero se crea con
+    permisos 0600 en un directorio 0700 y se rechaza si es de otro usuario.
+    Las lecturas no escriben: la expulsión es por antigüedad de escritura y
+    las entradas caducadas se borran al escribir, así que get() nunca espera
+    al bloqueo de escritura. La caducidad usa la hora del sistema, común a
+    los procesos. Cada hilo de cada proceso abre su propia conexión, y tras
+    un fork se abren conexiones nuevas. Un error del fichero se trata como un
+    fallo de caché, nunca como un error de la petición.
+    """
+    def __init__(self, path: str = CACHE_PATH, namespace: str = 'query',
+                 max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES):
+        self.path = path
+        # El sufijo es la versión del formato: un fichero de una versión anterior no se mezcla
+        self.table = f"cache_{namespace}_v2"
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._local = threading.local()
+        _create_private_file(path)
+        connection = self._connection()
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                           "key TEXT PRIMARY KEY, value BLOB, expires_at REAL, size INTEGER, created REAL)")
+        connection.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_created ON {self.table} (created)")
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {self.table}_tables ("
+                           "table_name TEXT, key TEXT, PRIMARY KEY (table_name, key)) WITHOUT ROWID")
+
+    def get(self, key: str):
+        try:
+            # Las caducadas se ignoran aquí y las borra la siguiente escritura
+            row = self._connection().execute(f"SELECT value FROM {self.table} WHERE key = ? AND expires_at > ?",
+                                             (key, time.time())).fetchone()
+            return None if row is None else _decode_cache_value(row[0])
+        except sqlite3.Error as e:
+            logger.warning("Caché compartida no disponible (%s): %s", self.path, e)
+            return None
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning("Entrada ilegible en la caché compartida (%s): %s", self.path, e)
+            return None
+
+    def set(self, key: str, value, ttl: float, size: int = 0, tables=()):
+        try:
+            blob = _encode_cache_value(value)
+        except (ValueError, TypeError) as e:
+            logger.warning("Valor no serializable para la caché compartida: %s", e)
+            return
+        now = time.time()
+        try:
+            with self._transaction() as connection:
+                connection.execute(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?, ?)",
+                                   (key, blob, now + ttl, len(blob), now))
+                connection.execute(f"DELETE FROM {self.table}_tables WHERE key = ?", (key,))
+                connection.executemany(f"INSERT INTO {self.table}_tables VALUES (?, ?)",
+                                       [(table, key) for table in tables])
+                self._enforce_limits(connection, now)
+        except sqlite3.Error as e:
+            logger.warning("No se pudo guardar en la caché compartida (%s): %s", self.path, e)
+
+    def delete(self, key: str):
+        try:
+            with self._transaction() as connection:
+                connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                connection.execute(f"DELETE FROM {self.table}_tables WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            logger.warning("No se pudo borrar de la caché compartida (%s): %s", self.path, e)
+
+    def delete_tables(self, tables) -> int:
+        tables = list(tables)
+        if not tables:
+            return 0
+        placeholders = ", ".join("?" * len(tables))
+        dependents = f"SELECT key FROM {self.table}_tables WHERE table_name IN ({placeholders})"
+        try:
+            with self._transaction() as connection:
+                removed = connection.execute(f"DELETE FROM {self.table} WHERE key IN ({dependents})", tables).rowcount
+                connection.execute(f"DELETE FROM {self.table}_tables WHERE key IN ({dependents})", tables)
+            return removed
+        except sqlite3.Error as e:
+            logger.warning("No se pudo invalidar la caché compartida (%s): %s", self.path, e)
+            return 0
+
+    def clear(self):
+        try:
+            with self._transaction() as connection:
+                connection.execute(f"DELETE FROM {self.table}")
+                connection.execute(f"DELETE FROM {self.table}_tables")
+        except sqlite3.Error as e:
+            logger.warning("No se pudo vaciar la caché compartida (%s): %s", self.path, e)
+
+    def keys(self) -> list:
+        try:
+            return [row[0] for row in self._connection().execute(f"SELECT key FROM {self.table}")]
+        except sqlite3.Error as e:
+            logger.warning("Caché compartida no disponible (%s): %s", self.path, e)
+            return []
+
+    def stats(self) -> dict:
+        stats = {'backend': 'sqlite', 'path': self.path, 'entries': 0, 'bytes': 0, 'evictions': self.evictions}
+        try:
+            entries, size = self._connection().execute(f"SELECT COUNT(*), TOTAL(size) FROM {self.table}").fetchone()
+            stats.update(entries=entries, bytes=int(size))
+        except sqlite3.Error as e:
+            stats['error'] = str(e)
+        return stats
+
+    def _enforce_limits(self, connection, now):
+        expired = connection.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (now,)).rowcount
+        entries, size = connection.execute(f"SELECT COUNT(*), TOTAL(size) FROM {self.table}").fetchone()
+        excess = entries - self.max_entries
+        if size > self.max_bytes:
+            # Sin tamaños individuales a mano, se expulsa la parte proporcional más antigua
+            excess = max(excess, int(entries * (1 - self.max_bytes / size)) + 1)
+        if excess > 0:
+            connection.execute(f"DELETE FROM {self.table} WHERE key IN "
+                               f"(SELECT key FROM {self.table} ORDER BY created LIMIT ?)", (excess,))
+            self.evictions += excess
+        if excess > 0 or expired:
+            connection.execute(f"DELETE FROM {self.table}_tables WHERE key NOT IN (SELECT key FROM {self.table})")
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            # Las conexiones heredadas de otro proceso no se pueden usar tras un fork
+            connection = sqlite3.connect(self.path, timeout=CACHE_BUSY_TIMEOUT, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+
+def _create_private_file(path: str):
+    """Crea el fichero de la caché (0600) y su directorio (0700); rechaza uno que sea de otro usuario."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+    try:
+        if hasattr(os, 'getuid') and os.fstat(fd).st_uid != os.getuid():
+            raise PermissionError(f"{path} pertenece a otro usuario")
+    finally:
+        os.close(fd)
+
+
+# Formato de los valores de la caché compartida: un byte de tipo y el contenido
+_CACHE_TEXT, _CACHE_JSON, _CACHE_TUPLE, _CACHE_FRAME = b's', b'j', b't', b'f'
+
+
+def _encode_cache_value(value) -> bytes:
+    """
+    Serializa un valor de caché sin pickle: texto tal cual (figuras ya
+    serializadas), tuplas y valores JSON (conteos) y DataFrames como JSON por
+    columnas con su dtype, de modo que al leerlos se recuperan los tipos
+    (enteros, reales, fechas, categóricos). El índice no se guarda.
+    """
+    if isinstance(value, str):
+        return _CACHE_TEXT + value.encode('utf-8')
+    if isinstance(value, pd.DataFrame):
+        document = {
+            'columns': [str(name) for name in value.columns],
+            'dtypes': [str(dtype) for dtype in value.dtypes],
+            'data': [value.iloc[:, i].tolist() for i in range(value.shape[1])],
+        }
+        return _CACHE_FRAME + json.dumps(document, default=_cache_json_default).encode('utf-8')
+    if isinstance(value, tuple):
+        return _CACHE_TUPLE + json.dumps(list(value), default=_cache_json_default).encode('utf-8')
+    return _CACHE_JSON + json.dumps(value, default=_cache_json_default).encode('utf-8')
+
+
+def _decode_cache_value(blob: bytes):
+    kind, content = blob[:1], bytes(blob[1:])
+    if kind == _CACHE_TEXT:
+        return content.decode('utf-8')
+    if kind == _CACHE_TUPLE:
+        return tuple(json.loads(content))
+    if kind == _CACHE_JSON:
+        return json.loads(content)
+    if kind != _CACHE_FRAME:
+        raise ValueError(f"tipo de entrada desconocido {kind!r}")
+    document = json.loads(content)
+    df = pd.DataFrame({i: _restore_column(values, dtype)
+                       for i, (values, dtype) in enumerate(zip(document['data'], document['dtypes']))})
+    df.columns = document['columns']
+    return df
+
+
+def _restore_column(values: list, dtype: str) -> pd.Series:
+    if dtype.startswith('datetime64'):
+        return pd.Series(pd.to_datetime(values, errors='coerce', format='ISO8601'))
+    return pd.Series(values, dtype=dtype)
+
+
+def _cache_json_default(value):
+    if value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, (datetime, date, dt_time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"tipo no serializable en la caché: {type(value).__name__}")
+
+
+def create_cache_backend(namespace: str, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES):
+    """Backend de caché según CACHE_BACKEND; `namespace` separa las cachés dentro del fichero compartido."""
+    if CACHE_BACKEND == 'sqlite':
+        try:
+            return SQLiteCacheBackend(CACHE_PATH, namespace, max_entries, max_bytes)
+        except (OSError, sqlite3.Error) as e:
+            logger.error("No se pudo abrir la caché compartida %s (%s): se usa la caché en memoria", CACHE_PATH, e)
+    return MemoryCacheBackend(max_entries, max_bytes)
+
+
+class _SingleFlight:
+    """
+    Agrupa las cargas concurrentes de una misma clave: el primer hilo ejecuta
+    la carga y el resto espera su resultado en lugar de repetirla.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> [evento, resultado, excepción]
+
+    def do(self, key, loader):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = [threading.Event(), None, None]
+                self._calls[key] = call
+        if not leader:
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return call[1], True
+        try:
+            call[1] = loader()
+        except Exception as e:
+            call[2] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call[0].set()
+        return call[1], False
+
+
+class TableGenerations:
+    """
+    Generación de cada tabla: cuántas veces se han invalidado sus entradas.
+    Quien carga un resultado anota con current() las generaciones de sus
+    tablas antes de consultar y solo lo guarda si siguen iguales al terminar;
+    así una carga que empezó antes de una invalidación y acaba después no
+    deja en la caché, con un TTL completo, datos anteriores al cambio.
+    """
+    def __init__(self):
+        self._generations = {}
+        self._epoch = 0  # invalidaciones completas
+        self._lock = threading.Lock()
+
+    def current(self, tables) -> tuple:
+        with self._lock:
+            return self._epoch, tuple(self._generations.get(table, 0) for table in sorted(tables))
+
+    def advance(self, tables=None):
+        """Marca `tables` (todas con None) como invalidadas."""
+        with self._lock:
+            if tables is None:
+                self._epoch += 1
+                return
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+
+
+TABLE_REFERENCE = re.compile(r"\b(?:FROM|JOIN)\s+`?(\w+)`?", re.IGNORECASE)
+
+
+def tables_in_query(query: str) -> set:
+    """Tablas que aparecen tras FROM/JOIN en la consulta."""
+    return {name.lower() for name in TABLE_REFERENCE.findall(query)}
+
+
+class QueryCache:
+    """
+    Caché de resultados de consultas indexada por el SQL normalizado y sus
+    parámetros. El almacenamiento se delega en un backend intercambiable
+    (por defecto MemoryCacheBackend) con get/set/delete/clear/stats.
+    Cada entrada se guarda con las tablas que lee, así invalidate_tables()
+    descarta solo los resultados afectados por un cambio de datos (y, con
+    TableGenerations, los que se estaban cargando mientras tanto).
+    """
+    def __init__(self, backend=None, default_ttl: float = CACHE_TTL):
+        self.backend = backend if backend is not None else MemoryCacheBackend()
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._flight = _SingleFlight()
+        self._generations = TableGenerations()
+
+    @staticmethod
+    def make_key(query: str, params: dict = None) -> str:
+        # Normalizar espacios y el ';' final para que la misma consulta escrita
+        # de distinta forma comparta entrada
+        normalized = " ".join(query.split()).rstrip(';').strip()
+        params_json = json.dumps(params or {}, sort_keys=True, default=str)
+        return hashlib.sha1(f"{normalized}|{params_json}".encode('utf-8')).hexdigest()
+
+    def get_or_load(self, query: str, params: dict, loader, ttl: float = None):
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0:
+            return loader()
+        key = self.make_key(query, params)
+        value = self.backend.get(key)
+        if value is not None:
+            self._count(hit=True)
+            return value
+
+        def load():
+            # Otro hilo pudo haberla cargado mientras esperábamos
+            cached = self.backend.get(key)
+            if cached is not None:
+                return cached, True
+            # '*' agrupa las consultas en las que no se reconoce ninguna tabla
+            tables = tables_in_query(query) or {'*'}
+            generation = self._generations.current(tables)
+            result = loader()
+            # Si sus tablas se invalidaron durante la carga, el resultado se devuelve pero no se guarda
+            if self._generations.current(tables) == generation:
+                self.backend.set(key, result, ttl, _estimate_size(result), tables=tables)
+            return result, False
+
+        (value, was_cached), shared = self._flight.do(key, load)
+        self._count(hit=was_cached or shared)
+        return value
+
+    def invalidate(self, query: str = None, params: dict = None):
+        """Invalida una consulta concreta o, sin argumentos, toda la caché."""
+        if query is None:
+            self._generations.advance()
+            self.backend.clear()
+        else:
+            self.backend.delete(self.make_key(query, params))
+
+    def invalidate_tables(self, tables) -> int:
+        """Descarta las entradas que leen alguna de `tables`; devuelve cuántas."""
+        tables = {table.lower() for table in tables} | {'*'}
+        self._generations.advance(tables)
+        return self.backend.delete_tables(tables)
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {'hits': hits, 'misses': misses,
+                'hit_ratio': hits / total if total else 0.0,
+                **self.backend.stats()}
+
+    def _count(self, hit: bool):
+        instrumentation.record_cache(hit)
+        with self._lock:
+            if hit: self.hits += 1
+            else: self.misses += 1
+
+
+def _estimate_size(value) -> int:
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    return 0
+
+
+query_cache = QueryCache(create_cache_backend('query'))
+
+
+# Lectura de resultados
+FETCH_ENGINE = os.getenv('FETCH_ENGINE', 'columnar').lower()  # 'columnar' o 'pandas' (pd.read_sql)
+FETCH_BATCH_SIZE = int(os.getenv('FETCH_BATCH_SIZE', '5000'))
+CATEGORY_MAX_RATIO = 0.5  # texto con menos de un 50% de valores distintos se guarda como categórico
+
+
+def _run_query(query: str, params: dict, timeout: float = None) -> pd.DataFrame:
+    start = time.perf_counter()
+    df = _execute(query, params, timeout)
+    # Tiempo de base de datos: ejecución más lectura de todas las filas
+    instrumentation.record_query(query, params, time.perf_counter() - start, len(df), engine)
+    return df
+
+
+def _execute(query: str, params: dict, timeout: float = None) -> pd.DataFrame:
+    if timeout and engine.dialect.name == 'mariadb':
+        # MariaDB corta la consulta en el servidor al superar el tiempo máximo
+        query = f"SET STATEMENT max_statement_time={float(timeout)} FOR {query.strip()}"
+    elif engine.dialect.name == 'sqlite':
+        query = embedded.translate_sql(query)
+    # Usar text() indica al engine que se va introducir SQL literal
+    sql_text = text(query)
+    if FETCH_ENGINE == 'pandas':
+        return pd.read_sql(sql_text, engine, params=params)
+    return _read_columnar(sql_text, params)
+
+
+def _read_columnar(sql_text, params: dict, batch_size: int = FETCH_BATCH_SIZE) -> pd.DataFrame:
+    """
+    Lee el resultado por lotes con un cursor en streaming y va convirtiendo
+    cada lote en arrays de NumPy tipados, columna a columna, sin construir
+    filas intermedias: DECIMAL/FLOAT -> float64, enteros -> int64 (float64 si
+    hay NULL), fechas -> datetime64 y texto repetitivo (CHAR de códigos,
+    continentes...) -> categórico. Cada lote se libera al convertirlo.
+    """
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(sql_text, params)
+        names = list(result.keys())
+        columns = [[] for _ in names]
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            for i, values in enumerate(zip(*rows)):
+                columns[i].append(_batch_to_array(values))
+            del rows
+    return pd.DataFrame({name: _finish_column(chunks) for name, chunks in zip(names, columns)}, columns=names)
+
+
+def _batch_to_array(values: tuple) -> np.ndarray:
+    sample = next((v for v in values if v is not None), None)
+    if isinstance(sample, bool):
+        return np.array(values, dtype=object)
+    if isinstance(sample, (int, float, Decimal)):
+        # SQLite puede devolver enteros y reales mezclados en la misma columna DECIMAL
+        kinds = set(map(type, values))
+        if kinds == {int}:
+            try:
+                return np.array(values, dtype=np.int64)
+            except OverflowError:
+                pass
+        if kinds <= {int, float, Decimal, type(None)}:
+            return np.array(values, dtype=np.float64)  # NULL -> NaN
+    return np.array(values, dtype=object)
+
+
+def _finish_column(chunks: list):
+    if not chunks:
+        return np.array([], dtype=object)
+    kinds = {chunk.dtype.kind for chunk in chunks}
+    if kinds <= {'i', 'f'} and len(kinds) > 1:
+        chunks = [chunk.astype(np.float64) for chunk in chunks]
+    elif 'O' in kinds and len(kinds) > 1:
+        # Lotes sin valores (todo NULL) frente a lotes de texto
+        chunks = [chunk.astype(object) for chunk in chunks]
+    array = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+    if array.dtype != object or len(array) == 0:
+        return array
+    sample = next((v for v in array if v is not None), None)
+    if isinstance(sample, (datetime, date)) and not isinstance(sample, dt_time):
+        return pd.to_datetime(array, errors='coerce')
+    if isinstance(sample, str) and len(array) >= 32:
+        categorical = pd.Categorical(array)
+        if len(categorical.categories) <= CATEGORY_MAX_RATIO * len(array):
+            return categorical
+    return array
+
+
+def frame_to_records(df: pd.DataFrame) -> list:
+    """
+    Registros JSON-compatibles para dash_table (NaN -> None, fechas en ISO).
+    Se serializa todo el DataFrame de una vez con el escritor JSON de pandas
+    (en C) en lugar de ir celda a celda con to_dict('records').
+    """
+    if df.empty:
+        return []
+    return json.loads(df.to_json(orient='records', date_format='iso', default_handler=str))
+
+
+def _fetch(query: str, params: dict, ttl: float = None, use_cache: bool = True, timeout: float = None) -> pd.DataFrame:
+    # Igual que fetch_data pero propagando los errores
+    if engine is None:
+        raise RuntimeError("El engine de SQLAlchemy no está inicializado.")
+    if not use_cache:
+        return _run_query(query, params, timeout)
+    df = query_cache.get_or_load(query, params, lambda: _run_query(query, params, timeout), ttl=ttl)
+    # Copia superficial para que quien llama no altere la entrada cacheada
+    return df.copy(deep=False)
+
+
+def fetch_data(query: str, params: dict = None, ttl: float = None, use_cache: bool = True,
+               timeout: float = None) -> pd.DataFrame:
+    """
+    Ejecuta la consulta y devuelve un DataFrame. Los resultados se guardan en
+    query_cache durante `ttl` segundos (CACHE_TTL por defecto); ttl=0 o
+    use_cache=False fuerzan la ida a la base de datos. Los errores no se cachean.
+    Con `timeout` (segundos) MariaDB corta la consulta en el servidor.
+    """
     if engine is None:
-        print("Error: El engine de SQLAlchemy no está inicializado.")
+        logger.error("El engine de SQLAlchemy no está inicializado.")
         return pd.DataFrame()
 
     # Si no se pasan parámetros, inicializa como diccionario vacío
@@ -35,101 +761,271 @@ def fetch_data(query: str, params: dict = None) -> pd.DataFrame:
         params = {}
 
     try:
-        # Usar text() indica al engine que se va introducir SQL literal
-        sql_text = text(query)
-        df = pd.read_sql(sql_text, engine, params=params)
-        return df
+        return _fetch(query, params, ttl, use_cache, timeout)
     except SQLAlchemyError as e:
-        print(f"Error de SQLAlchemy: {e}\nQuery: {query}\nParams: {params}")
+        logger.error("Error de SQLAlchemy: %s", e, extra={'query': query, 'params': params})
         return pd.DataFrame()
     except Exception as e:
-        print(f"Error inesperado en fetch_data: {e}\nQuery: {query}\nParams: {params}")
+        logger.exception("Error inesperado en fetch_data: %s", e, extra={'query': query, 'params': params})
         return pd.DataFrame()
 
 
+# Ejecución concurrente de consultas
+QUERY_WORKERS = int(os.getenv('QUERY_WORKERS', '8'))
+QUERY_TIMEOUT = float(os.getenv('QUERY_TIMEOUT', '30'))  # segundos por consulta
+
+
+class QueryExecutor:
+    """
+    Ejecuta consultas en un pool de hilos acotado. Permite lanzar varias
+    consultas a la vez desde una misma petición (fetch_many), agrupa las
+    consultas idénticas que ya están en curso para que compartan resultado
+    (single-flight) y aplica un tiempo máximo por consulta, tanto esperando
+    en Python como, en MariaDB, con max_statement_time en el servidor.
+    """
+    def __init__(self, max_workers: int = QUERY_WORKERS, default_timeout: float = QUERY_TIMEOUT):
+        self.max_workers = max_workers
+        self.default_timeout = default_timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='query')
+        self._inflight = {}  # key -> Future
+        self._lock = threading.Lock()
+        self._counters = {'submitted': 0, 'coalesced': 0, 'completed': 0, 'failed': 0, 'timeouts': 0,
+                          'queued': 0, 'running': 0}
+
+    def submit(self, query: str, params: dict = None, ttl: float = None, use_cache: bool = True,
+               timeout: float = None):
+        """Lanza la consulta y devuelve un Future con el DataFrame (los errores se propagan)."""
+        params = params or {}
+        timeout = self.default_timeout if timeout is None else timeout
+        key = (QueryCache.make_key(query, params), use_cache)
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self._counters['coalesced'] += 1
+                return future
+            self._counters['submitted'] += 1
+            self._counters['queued'] += 1
+            # La consulta cuenta en las métricas del callback que la lanzó
+            future = self._pool.submit(contextvars.copy_context().run, self._run, query, params, ttl, use_cache, timeout)
+            self._inflight[key] = future
+        future.add_done_callback(lambda f: self._finish(key, f))
+        return future
+
+    def submit_call(self, fn, *args, **kwargs):
+        """Ejecuta cualquier función que consulte la base de datos en el mismo pool acotado."""
+        with self._lock:
+            self._counters['submitted'] += 1
+            self._counters['queued'] += 1
+        future = self._pool.submit(contextvars.copy_context().run, self._call, fn, *args, **kwargs)
+        future.add_done_callback(lambda f: self._finish(None, f))
+        return future
+
+    def fetch_many(self, queries: dict, timeout: float = None) -> dict:
+        """
+        Ejecuta en paralelo {nombre: query} o {nombre: (query, params)} y
+        devuelve {nombre: DataFrame}. El tiempo total es el de la consulta más
+        lenta; si alguna falla o supera `timeout` se lanza la excepción.
+        """
+        timeout = self.default_timeout if timeout is None else timeout
+        futures = {}
+        for name, spec in queries.items():
+            query, params = spec if isinstance(spec, tuple) else (spec, None)
+            futures[name] = self.submit(query, params, use_cache=False, timeout=timeout)
+        deadline = time.monotonic() + timeout
+        results = {}
+        for name, future in futures.items():
+            results[name] = self.result(future, max(0.0, deadline - time.monotonic()))
+        return results
+
+    def result(self, future, timeout: float = None):
+        timeout = self.default_timeout if timeout is None else timeout
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self._counters['timeouts'] += 1
+            raise TimeoutError(f"La consulta superó el tiempo máximo de {timeout:.2f} s")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'workers': self.max_workers, 'queue_depth': self._counters['queued'],
+                    'inflight': len(self._inflight), **self._counters}
+
+    def reset_after_fork(self):
+        """En un proceso hijo los hilos del pool heredado no existen: se crea un pool nuevo."""
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='query')
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._counters.update(queued=0, running=0)
+
+    def _run(self, query, params, ttl, use_cache, timeout):
+        return self._call(_fetch, query, params, ttl, use_cache, timeout)
+
+    def _call(self, fn, *args, **kwargs):
+        with self._lock:
+            self._counters['queued'] -= 1
+            self._counters['running'] += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._counters['running'] -= 1
+
+    def _finish(self, key, future):
+        with self._lock:
+            if key is not None and self._inflight.get(key) is future:
+                del self._inflight[key]
+            if future.cancelled() or future.exception() is not None:
+                self._counters['failed'] += 1
+            else:
+                self._counters['completed'] += 1
+
+
+query_executor = QueryExecutor()
+
+
+def reset_after_fork():
+    """
+    Prepara un worker recién creado con fork: las conexiones del pool son del
+    proceso padre (se olvidan sin cerrarlas, dispose(close=False), para no
+    cortar las del padre) y los hilos del ejecutor no existen en el hijo.
+    """
+    if engine is not None:
+        engine.dispose(close=False)
+    query_executor.reset_after_fork()
+
+
+# Catálogo del esquema
+SCHEMA_CATALOG_TTL = int(os.getenv('SCHEMA_CATALOG_TTL', '300'))  # 0 = solo se recarga con refresh()
+
+SCHEMA_QUERY = """
+    SELECT c.TABLE_NAME, c.COLUMN_NAME, c.DATA_TYPE, c.IS_NULLABLE, t.TABLE_ROWS,
+           s.INDEX_NAME, s.SEQ_IN_INDEX, s.NON_UNIQUE
+    FROM information_schema.COLUMNS c
+    JOIN information_schema.TABLES t
+      ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME
+    LEFT JOIN information_schema.STATISTICS s
+      ON s.TABLE_SCHEMA = c.TABLE_SCHEMA AND s.TABLE_NAME = c.TABLE_NAME AND s.COLUMN_NAME = c.COLUMN_NAME
+    WHERE c.TABLE_SCHEMA = DATABASE()
+    ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION, s.INDEX_NAME, s.SEQ_IN_INDEX;
+"""
+
+
+class TableInfo:
+    """Metadatos de una tabla: columnas en orden, tipos, nulabilidad, clave primaria e índices."""
+    def __init__(self, name: str, rows_estimate=None):
+        self.name = name
+        self.columns = []
+        self.types = {}        # columna -> DATA_TYPE de information_schema (int, char, decimal...)
+        self.nullable = set()  # columnas que admiten NULL
+        self.indexes = {}      # nombre del índice -> [(posición, columna)] en orden
+        self.unique_indexes = set()
+        self.rows_estimate = rows_estimate
+
+    @property
+    def primary_key(self) -> list:
+        return self.index_columns('PRIMARY')
+
+    def add_column(self, column: str, data_type: str, nullable: bool):
+        if column not in self.types:
+            self.columns.append(column)
+            self.types[column] = data_type.lower()
+            if nullable:
+                self.nullable.add(column)
+
+    def add_index(self, index_name: str, position: int, column: str, unique: bool):
+        columns = self.indexes.setdefault(index_name, [])
+        columns.append((position, column))
+        columns.sort()
+        if unique:
+            self.unique_indexes.add(index_name)
+
+    def index_columns(self, index_name: str) -> list:
+        return [column for _, column in self.indexes.get(index_name, [])]
+
+
+class SchemaCatalog:
+    """
+    Catálogo en memoria de tablas, columnas, tipos, claves primarias e índices,
+    cargado con una sola consulta a information_schema. Se recarga con
+    refresh() o, si SCHEMA_CATALOG_TTL > 0, cuando caduca.
+    """
+    def __init__(self, ttl: float = SCHEMA_CATALOG_TTL):
+        self.ttl = ttl
+        self._tables = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def tables(self) -> dict:
+        """Diccionario nombre -> TableInfo, cargando el catálogo si hace falta."""
+        if self._loaded_at is None or (self.ttl > 0 and time.monotonic() - self._loaded_at > self.ttl):
+            with self._lock:
+                if self._loaded_at is None or (self.ttl > 0 and time.monotonic() - self._loaded_at > self.ttl):
+                    self._load()
+        return self._tables
+
+    def table_names(self) -> list:
+        return list(self.tables().keys())
+
+    def get(self, table_name: str):
+        return self.tables().get(table_name)
+
+    def refresh(self):
+        with self._lock:
+            self._load()
+
+    def _load(self):
+        # Si falla se conserva el catálogo anterior y se reintenta en la siguiente llamada
+        if engine is None: return
+        try:
+            with engine.connect() as connection:
+                if engine.dialect.name == 'sqlite':
+                    rows = embedded.schema_rows(connection)
+                else:
+                    rows = connection.execute(text(SCHEMA_QUERY)).all()
+        except Exception as e:
+            logger.error("Error al cargar el catálogo del esquema: %s", e)
+            return
+        tables = {}
+        for table_name, column, data_type, is_nullable, table_rows, index_name, seq_in_index, non_unique in rows:
+            table = tables.get(table_name)
+            if table is None:
+                table = tables[table_name] = TableInfo(table_name, int(table_rows) if table_rows is not None else None)
+            table.add_column(column, data_type, is_nullable == 'YES')
+            if index_name is not None:
+                table.add_index(index_name, int(seq_in_index), column, not int(non_unique))
+        self._tables = tables
+        self._loaded_at = time.monotonic()
+
+
+schema_catalog = SchemaCatalog()
+
+
 def get_table_names() -> list:
-    if engine is None: return []
-    try:
-        with engine.connect() as connection:
-            result = connection.execute(text("SHOW TABLES;"))
-            return [row[0] for row in result]
-    except Exception as e:
-        print(f"Error en get_table_names: {e}")
-        return []
+    return schema_catalog.table_names()
 
 
 def get_table_columns(table_name: str) -> list:
-    if engine is None: return []
-    if not table_name.replace('_', '').isalnum(): return []
-    try:
-        with engine.connect() as connection:
-            query = text(f'SHOW COLUMNS FROM `{table_name}`;')
-            result = connection.execute(query)
-            columns = [row[0] for row in result]
-            if not columns: # Fallback
-                query_desc = text(f'DESCRIBE `{table_name}`;')
-                result_desc = connection.execute(query_desc)
-                columns = [row[0] for row in result_desc]
-            return columns
-    except Exception as e:
-        print(f"Error en get_table_columns para '{table_name}': {e}")
-        return []
+    table = schema_catalog.get(table_name)
+    return list(table.columns) if table else []
+
+
+def get_primary_key(table_name: str) -> list:
+    """Columnas de la clave primaria de la tabla, en orden (lista vacía si no tiene)."""
+    table = schema_catalog.get(table_name)
+    return list(table.primary_key) if table else []
 
 # Funcion para buscar info desde las tablas filtrando por valores
-def parse_filter_query_named_params(query_string, valid_columns):
+def parse_filter_query_named_params(query_string, valid_columns, column_types=None):
     """
     Convierte el string de filtro de dash_table a una cláusula WHERE SQL
-    con parámetros nombrados (:param_0, :param_1...) y un diccionario de parámetros.
-    """
-    where_parts = []
-    sql_params_dict = {}
-    param_index = 0
-    if query_string:
-        filtering_expressions = query_string.split(' && ')
-        for filter_part in filtering_expressions:
-            # Operador 'contains'
-            if ' contains ' in filter_part or ' scontains ' in filter_part:
-                operator = ' contains ' if ' contains ' in filter_part else ' scontains '
-                col_name, value = filter_part.split(operator, 1)
-                col_name = col_name.strip().strip('{}')
-                value = value.strip().strip('"').strip("'")
-                if col_name in valid_columns:
-                    param_name = f"filter_param_{param_index}"
-                    where_parts.append(f"`{col_name}` LIKE :{param_name}")  # LIKE sigue siendo apropiado
-                    sql_params_dict[param_name] = f"%{value}%"
-                    param_index += 1
-                else:
-                    print(f"Advertencia: Columna de filtro inválida '{col_name}'.")
-
-            # Operador '='
-            """
-            elif ' = ' in filter_part or ' s= ' in filter_part:
-                col_name, value = filter_part.split(' s= ', 1)
-                col_name = col_name.strip().strip('{}')
-                value = value.strip().strip('"').strip("'")
-                if col_name in valid_columns:
-                    param_name = f"filter_param_{param_index}"
-                    # Intentar conversión numérica (muy básica)
-                    try:
-                        numeric_value = float(value)
-                        sql_params_dict[param_name] = numeric_value
-                    except ValueError:
-                        sql_params_dict[param_name] = value # Tratar como string
-                    where_parts.append(f"`{col_name}` = :{param_name}")
-                    param_index += 1
-                else: print(f"Advertencia: Columna de filtro inválida '{col_name}'.")
-            """
-
-            # Añadir más 'elif' para otros operadores (>, <, >=, <=, !=) si es necesario...
-            """
-            Esto significa que en el en la tabla en el campo de filter data puedes filtrar por 
-            = 1780000, > 1780000, < 1780000, >= 1780000 <= 1780000 o != 1780000 y hará la filtración correcta 
-            pero hay que definir esta parte, por el momento esta desactivada o no completada
-            """
-
-    # Construir cláusula WHERE
-    where_clause = " AND ".join(where_parts) if where_parts else "1=1"
-    return where_clause, sql_params_dict
+    con parámetros nombrados (:filter_param_0, :filter_param_1...) y un diccionario de parámetros.
+    Admite todos los operadores de dash_table (=, !=, <, <=, >, >=, contains,
+    datestartswith, is blank...) y convierte los valores según `column_types`
+    (columna -> DATA_TYPE del catálogo). Ver filter_compiler.FilterCompiler.
+    """
+    dialect = engine.dialect.name if engine is not None else 'mariadb'
+    return FilterCompiler(valid_columns, column_types, dialect=dialect).compile(query_string)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,297 @@
+"""
+Motor embebido (SQLite) para ejecutar la aplicación sin servidor MariaDB.
+
+La base de datos se crea a partir de un volcado tipo mysqldump (world.sql),
+cargado con load_dump, o copiando las tablas de la base de datos configurada, conservando claves
+primarias e índices. Incluye la capa de dialecto que necesita db_utils:
+configuración de cada conexión, traducción de SHOW TABLES / SHOW COLUMNS /
+DESCRIBE y lectura del esquema para el catálogo.
+
+Uso:
+    python embedded.py --from-dump world.sql --output world.db   (equivale a load_dump.py --target sqlite)
+    python embedded.py --from-db --output world.db   (copia la base de datos de .env)
+"""
+import argparse
+import logging
+import os
+import re
+import sqlite3
+import time
+from filter_compiler import column_kind
+from load_dump import CREATE_TABLE, LOAD_BATCH_SIZE, load_dump
+
+logger = logging.getLogger(__name__)
+
+# Ajustes de cada conexión: lecturas concurrentes (WAL) y caché/mmap generosos
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+)
+
+# Tipos de MySQL sin equivalente directo en la sintaxis de SQLite
+TYPE_REPLACEMENTS = (
+    (re.compile(r"^enum\(.*\)$", re.IGNORECASE | re.DOTALL), 'char'),
+    (re.compile(r"^set\(.*\)$", re.IGNORECASE | re.DOTALL), 'char'),
+)
+COLUMN_OPTIONS_TO_DROP = re.compile(
+    r"\s+(AUTO_INCREMENT|CHARACTER SET \w+|COLLATE \w+|COMMENT '(?:[^'\\]|\\.)*'|ON UPDATE CURRENT_TIMESTAMP)",
+    re.IGNORECASE)
+# Las colaciones por defecto de MariaDB (*_ci) no distinguen mayúsculas; SQLite compara en BINARY
+TEXT_COLLATION = " COLLATE NOCASE"
+
+
+def configure_connection(dbapi_connection, connection_record=None):
+    """Listener de 'connect' del engine de SQLAlchemy."""
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+# Traducción de consultas
+
+SHOW_TABLES = re.compile(r"^\s*SHOW\s+TABLES\s*;?\s*$", re.IGNORECASE)
+SHOW_COLUMNS = re.compile(r"^\s*(?:SHOW\s+COLUMNS\s+FROM|DESCRIBE|DESC)\s+`?(\w+)`?\s*;?\s*$", re.IGNORECASE)
+
+
+def translate_sql(query: str) -> str:
+    """Traduce las sentencias propias de MariaDB que no existen en SQLite (los backticks sí los entiende)."""
+    if SHOW_TABLES.match(query):
+        return "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%' ORDER BY name;"
+    match = SHOW_COLUMNS.match(query)
+    if match:
+        return (f"SELECT name AS Field, type AS Type, CASE WHEN \"notnull\" THEN 'NO' ELSE 'YES' END AS \"Null\", "
+                f"CASE WHEN pk > 0 THEN 'PRI' ELSE '' END AS \"Key\", dflt_value AS \"Default\" "
+                f"FROM pragma_table_info('{match.group(1)}') ORDER BY cid;")
+    return query
+
+
+def schema_rows(connection) -> list:
+    """
+    Filas con la misma forma que SCHEMA_QUERY de db_utils:
+    (tabla, columna, tipo, nulable, filas estimadas, índice, posición, no_único).
+    """
+    # Acepta una conexión de SQLAlchemy o una de sqlite3
+    cursor = connection.connection.cursor() if hasattr(connection, 'connection') else connection.cursor()
+    estimates = {}
+    if cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+        for table_name, stat in cursor.execute("SELECT tbl, stat FROM sqlite_stat1"):
+            if stat:
+                estimates[table_name] = max(estimates.get(table_name, 0), int(stat.split()[0]))
+    rows = []
+    tables = [name for (name,) in cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+    for table_name in tables:
+        columns = cursor.execute(f"PRAGMA table_info(`{table_name}`)").fetchall()
+        index_columns = {}  # columna -> [(índice, posición, no_único)]
+        for _, column, _, _, _, pk in columns:
+            if pk:
+                index_columns.setdefault(column, []).append(('PRIMARY', pk, 0))
+        for _, index_name, unique, origin, _ in cursor.execute(f"PRAGMA index_list(`{table_name}`)").fetchall():
+            if origin == 'pk':
+                continue
+            for seq, _, column in cursor.execute(f"PRAGMA index_info(`{index_name}`)").fetchall():
+                index_columns.setdefault(column, []).append((index_name, seq + 1, 0 if unique else 1))
+        for _, column, declared_type, notnull, _, _ in columns:
+            data_type = base_type(declared_type)
+            nullable = 'NO' if notnull else 'YES'
+            for index_name, position, non_unique in index_columns.get(column, [(None, None, None)]):
+                rows.append((table_name, column, data_type, nullable, estimates.get(table_name),
+                             index_name, position, non_unique))
+    cursor.close()
+    return rows
+
+
+def base_type(declared_type: str) -> str:
+    """'decimal(10,2)' -> 'decimal', 'int unsigned' -> 'int'."""
+    return (declared_type or '').split('(')[0].split()[0].lower() if declared_type else ''
+
+
+# Conversión de un volcado de mysqldump
+
+def mysql_create_to_sqlite(statement: str):
+    """Devuelve (nombre, CREATE TABLE para SQLite, [CREATE INDEX ...]) de un CREATE TABLE de MySQL."""
+    match = CREATE_TABLE.search(statement.strip().rstrip(';'))
+    if not match:
+        raise ValueError("CREATE TABLE no reconocido")
+    table_name, body = match.groups()
+    definitions, indexes = [], []
+    for line in _split_definitions(body):
+        line = line.strip()
+        upper = line.upper()
+        if line.startswith('`'):
+            name_end = line.index('`', 1)
+            name, rest = line[:name_end + 1], line[name_end + 1:].strip()
+            type_match = re.match(r"(\w+(?:\s*\([^)]*\))?(?:\s+unsigned)?)(.*)$", rest, re.IGNORECASE | re.DOTALL)
+            column_type, options = type_match.groups()
+            for pattern, replacement in TYPE_REPLACEMENTS:
+                column_type = pattern.sub(replacement, column_type)
+            options = COLUMN_OPTIONS_TO_DROP.sub('', options)
+            collation = TEXT_COLLATION if column_kind(base_type(column_type)) == 'text' else ''
+            definitions.append(f"{name} {column_type}{collation}{options}")
+        elif upper.startswith('PRIMARY KEY'):
+            definitions.append(re.sub(r"\s+USING \w+", '', line))
+        elif upper.startswith(('UNIQUE KEY', 'UNIQUE INDEX', 'KEY', 'INDEX')):
+            key_match = re.match(r"(UNIQUE\s+)?(?:KEY|INDEX)\s+`(\w+)`\s*\((.*)\)", line, re.IGNORECASE)
+            if key_match:
+                unique, index_name, columns = key_match.groups()
+                columns = re.sub(r"\(\d+\)", '', columns)  # prefijos de índice (col(10))
+                indexes.append(f"CREATE {'UNIQUE ' if unique else ''}INDEX `{table_name}__{index_name}` "
+                               f"ON `{table_name}` ({columns})")
+        # CONSTRAINT ... FOREIGN KEY: SQLite no las aplica por defecto, se omiten
+    return table_name, f"CREATE TABLE `{table_name}` ({', '.join(definitions)})", indexes
+
+
+class SQLiteTarget:
+    """
+    Destino de load_dump.load_dump: un fichero SQLite nuevo. Sin diario ni
+    fsync durante la carga; los índices secundarios se crean al final, sobre
+    los datos ya cargados, y después se ejecuta ANALYZE para el catálogo.
+    """
+    def __init__(self, db_path: str):
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA journal_mode=OFF")
+        self.connection.execute("PRAGMA synchronous=OFF")
+        self.indexes = []
+
+    def create_table(self, table_name: str, statement: str):
+        _, create_sql, indexes = mysql_create_to_sqlite(statement)
+        self.connection.execute(f"DROP TABLE IF EXISTS `{table_name}`")
+        self.connection.execute(create_sql)
+        self.indexes.extend(indexes)
+
+    def insert_rows(self, table_name: str, columns, rows: list):
+        placeholders = ", ".join("?" * len(rows[0]))
+        target = f"`{table_name}` ({', '.join(f'`{c}`' for c in columns)})" if columns else f"`{table_name}`"
+        self.connection.executemany(f"INSERT INTO {target} VALUES ({placeholders})", rows)
+
+    def finish(self):
+        for index_sql in self.indexes:
+            self.connection.execute(index_sql)
+        self.connection.execute("ANALYZE")
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def build_from_dump(dump_path: str, db_path: str, batch_size: int = LOAD_BATCH_SIZE):
+    """
+    Crea `db_path` a partir del volcado con load_dump. Se escribe en un
+    fichero temporal y se renombra al terminar, así nunca queda una base de
+    datos a medias. Devuelve las estadísticas de la carga (LoadStats).
+    """
+    temp_path = f"{db_path}.tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    stats = load_dump(dump_path, SQLiteTarget(temp_path), batch_size)
+    os.replace(temp_path, db_path)
+    logger.info("Base de datos embebida creada en %s desde %s: %d filas en %.2f s",
+                db_path, dump_path, stats.total_rows, stats.elapsed)
+    return stats
+
+
+def copy_from_engine(source_engine, tables: dict, db_path: str, chunk_size: int = 10000) -> dict:
+    """
+    Copia en `db_path` las tablas de otra base de datos. `tables` es el
+    catálogo de db_utils (nombre -> TableInfo) con columnas, tipos, clave
+    primaria e índices.
+    """
+    from sqlalchemy import text
+
+    start = time.perf_counter()
+    temp_path = f"{db_path}.tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    connection = sqlite3.connect(temp_path)
+    counts = {}
+    try:
+        connection.execute("PRAGMA journal_mode=OFF")
+        connection.execute("PRAGMA synchronous=OFF")
+        for table_name, info in tables.items():
+            columns_sql = [f"`{col}` {'char' if info.types[col] in ('enum', 'set') else info.types[col]}"
+                           f"{TEXT_COLLATION if column_kind(info.types[col]) == 'text' else ''}"
+                           f"{'' if col in info.nullable else ' NOT NULL'}" for col in info.columns]
+            if info.primary_key:
+                columns_sql.append(f"PRIMARY KEY ({', '.join(f'`{c}`' for c in info.primary_key)})")
+            connection.execute(f"CREATE TABLE `{table_name}` ({', '.join(columns_sql)})")
+            placeholders = ", ".join("?" * len(info.columns))
+            insert_sql = f"INSERT INTO `{table_name}` VALUES ({placeholders})"
+            select_sql = f"SELECT {', '.join(f'`{c}`' for c in info.columns)} FROM `{table_name}`"
+            counts[table_name] = 0
+            with source_engine.connect() as source:
+                result = source.execution_options(stream_results=True).execute(text(select_sql))
+                while True:
+                    rows = result.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    connection.executemany(insert_sql, [tuple(_sqlite_value(v) for v in row) for row in rows])
+                    counts[table_name] += len(rows)
+            for index_name in info.indexes:
+                if index_name == 'PRIMARY':
+                    continue
+                unique = 'UNIQUE ' if index_name in info.unique_indexes else ''
+                index_columns = ', '.join(f'`{c}`' for c in info.index_columns(index_name))
+                connection.execute(f"CREATE {unique}INDEX `{table_name}__{index_name}` ON `{table_name}` ({index_columns})")
+        connection.execute("ANALYZE")
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(temp_path, db_path)
+    logger.info("Base de datos embebida creada en %s: %d filas en %.2f s",
+                db_path, sum(counts.values()), time.perf_counter() - start)
+    return counts
+
+
+def _sqlite_value(value):
+    # Decimal, fechas y horas no son tipos nativos de sqlite3
+    if value is None or isinstance(value, (int, float, str, bytes)):
+        return value
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if hasattr(value, 'total_seconds'):
+        return str(value)
+    return float(value) if hasattr(value, 'as_tuple') else str(value)
+
+
+def _split_definitions(body: str) -> list:
+    """Divide el cuerpo del CREATE TABLE por las comas de primer nivel."""
+    parts, depth, current, quote = [], 0, [], False
+    for char in body:
+        if char == "'":
+            quote = not quote
+        elif not quote and char == '(':
+            depth += 1
+        elif not quote and char == ')':
+            depth -= 1
+        if char == ',' and depth == 0 and not quote:
+            parts.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append(''.join(current))
+    return [part for part in parts if part.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--from-dump', metavar='SQL', help='volcado de mysqldump (p. ej. world.sql)')
+    source.add_argument('--from-db', action='store_true', help='copiar la base de datos configurada en .env')
+    parser.add_argument('--output', default='world.db', help='fichero SQLite a crear')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.from_dump:
+        print(build_from_dump(args.from_dump, args.output).report())
+    else:
+        import db_utils
+        if db_utils.engine is None:
+            raise SystemExit("Error: El engine de SQLAlchemy no está inicializado.")
+        copy_from_engine(db_utils.engine, db_utils.schema_catalog.tables(), args.output)
+
+
+if __name__ == '__main__':
+    main()
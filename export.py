@@ -0,0 +1,129 @@
+import csv
+import io
+import os
+import pandas as pd
+from sqlalchemy import text
+import db_utils
+from db_utils import schema_catalog, parse_filter_query_named_params
+
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '10000'))
+EXPORT_FORMATS = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+
+class ExportError(ValueError):
+    pass
+
+
+def build_export_query(table_name: str, filter_query: str = '', sort: str = ''):
+    """
+    SELECT de toda la tabla con el mismo WHERE que la página de tablas
+    (parse_filter_query_named_params) y el orden indicado en `sort`
+    ('col:asc,col2:desc'), con la clave primaria como desempate.
+    """
+    table_info = schema_catalog.get(table_name)
+    if table_info is None or not table_info.columns:
+        raise ExportError(f"Tabla '{table_name}' no encontrada")
+    columns = table_info.columns
+    where_clause, params = parse_filter_query_named_params(filter_query, columns, table_info.types)
+
+    order = []
+    for part in (sort or '').split(','):
+        column, _, direction = part.partition(':')
+        direction = direction.upper() or 'ASC'
+        if column in columns and direction in ('ASC', 'DESC'):
+            order.append((column, direction))
+    order += [(col, 'ASC') for col in table_info.primary_key if col not in {c for c, _ in order}]
+    if not order:
+        order = [(columns[0], 'ASC')]
+
+    safe_columns_str = ", ".join([f"`{c}`" for c in columns])
+    order_by_clause = "ORDER BY " + ", ".join(f"`{col}` {direction}" for col, direction in order)
+    query = f"SELECT {safe_columns_str} FROM `{table_name}` WHERE {where_clause} {order_by_clause};"
+    return query, params, columns
+
+
+def stream_rows(query: str, params: dict, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Genera las filas en bloques de `chunk_size` usando un cursor del
+    lado del servidor, así la memoria no depende del tamaño del resultado.
+    Si quien consume deja de iterar (el cliente se desconecta), la conexión
+    se cierra y la consulta se cancela.
+    """
+    if db_utils.engine is None:
+        raise ExportError("El engine de SQLAlchemy no está inicializado.")
+    with db_utils.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(text(query), params)
+        try:
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            result.close()
+
+
+def iter_csv(query: str, params: dict, columns: list, chunk_size: int = EXPORT_CHUNK_SIZE):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(columns)
+    yield buffer.getvalue().encode('utf-8')
+    for rows in stream_rows(query, params, chunk_size):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+
+
+def iter_parquet(query: str, params: dict, columns: list, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """Parquet en streaming: un row group por bloque. Necesita pyarrow (opcional)."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _DrainableBuffer()
+    writer = None
+    try:
+        for rows in stream_rows(query, params, chunk_size):
+            frame = pd.DataFrame.from_records(rows, columns=columns)
+            if writer is None:
+                table = pa.Table.from_pandas(frame, preserve_index=False)
+                writer = pq.ParquetWriter(sink, table.schema)
+            else:
+                table = pa.Table.from_pandas(frame, schema=writer.schema, preserve_index=False)
+            writer.write_table(table)
+            yield sink.drain()
+        if writer is None:
+            writer = pq.ParquetWriter(sink, pa.schema([(name, pa.string()) for name in columns]))
+    finally:
+        if writer is not None:
+            writer.close()
+    yield sink.drain()
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class _DrainableBuffer(io.RawIOBase):
+    """Destino de escritura que acumula bytes hasta que se vacían con drain()."""
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import plotly.io as pio
+import db_utils
+import instrumentation
+
+# Figuras guardadas en total (cada combinación de gráfico y filtro del dashboard es una entrada)
+FIGURE_CACHE_MAX_ENTRIES = int(os.getenv('FIGURE_CACHE_MAX_ENTRIES', '256'))
+# Segundos que una figura vive en la caché compartida entre procesos (CACHE_BACKEND=sqlite)
+FIGURE_CACHE_TTL = int(os.getenv('FIGURE_CACHE_TTL', '86400'))
+
+
+class FigureCache:
+    """
+    Caché de figuras terminadas de Plotly. Cada gráfico guarda el JSON ya
+    serializado de su figura y ese JSON ya parseado (un dict simple) junto con
+    la versión de los datos con la que se construyó; mientras la versión no
+    cambie, los callbacks reciben el dict sin volver a ejecutar plotly.express
+    ni su validación. Dash vuelve a codificar a JSON lo que devuelve cada
+    callback, así que los bytes ya serializados solo se envían tal cual por la
+    ruta /_internal/figures/<id>.json (payload()).
+    Con filtros cruzados cada gráfico tiene una entrada por variante (el
+    filtro activo); las menos usadas se descartan al superar `max_entries`.
+    Con `store` (un backend de db_utils compartido entre procesos) cada figura
+    construida se publica allí y los demás workers la toman en lugar de
+    construirla; la clave incluye la versión, que es una huella de los datos.
+    Una figura cuyo gráfico se invalida mientras se construye se sirve pero
+    no se guarda (db_utils.TableGenerations).
+    """
+    def __init__(self, max_entries: int = FIGURE_CACHE_MAX_ENTRIES, store=None):
+        self.max_entries = max_entries
+        self.store = store
+        self._entries = OrderedDict()  # (chart_id, variante) -> {'version', 'payload', 'figure'}
+        self._stats = {}    # chart_id -> contadores de construcción y servicio
+        self._lock = threading.Lock()
+        self._build_locks = {}
+        self._generations = db_utils.TableGenerations()  # por chart_id
+
+    def get(self, chart_id: str, version, builder, variant=None) -> dict:
+        """
+        Devuelve la figura de `chart_id` (como dict, no serializada) para la
+        versión de datos `version` y la variante `variant` (hashable, p. ej.
+        el filtro cruzado activo).
+        `builder` solo se llama cuando no hay figura para esa versión.
+        """
+        start = time.perf_counter()
+        key = (chart_id, variant)
+        entry = self._lookup(key)
+        instrumentation.record_cache(entry is not None and entry['version'] == version)
+        if entry is None or entry['version'] != version:
+            # Un solo hilo construye cada gráfico; el resto espera y reutiliza
+            with self._build_lock(key):
+                entry = self._lookup(key)
+                if entry is None or entry['version'] != version:
+                    entry = self._load_shared(key, version) or self._build(key, version, builder)
+        self._record(chart_id, 'serve', time.perf_counter() - start)
+        return entry['figure']
+
+    def payload(self, chart_id: str):
+        """Devuelve (versión, JSON serializado) de la última figura sin filtro construida, o None."""
+        entry = self._entries.get((chart_id, None))
+        if entry is None:
+            return None
+        self._record(chart_id, 'serve', 0.0)
+        return entry['version'], entry['payload']
+
+    def invalidate(self, chart_id: str = None):
+        self._generations.advance(None if chart_id is None else (chart_id,))
+        with self._lock:
+            if chart_id is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == chart_id]:
+                    del self._entries[key]
+        if self.store is not None:
+            if chart_id is None:
+                self.store.clear()
+            else:
+                self.store.delete_tables((chart_id,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {chart_id: dict(values) for chart_id, values in self._stats.items()}
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _build(self, key, version, builder) -> dict:
+        start = time.perf_counter()
+        generation = self._generations.current((key[0],))
+        fig = builder()
+        payload = pio.to_json(fig, validate=False)
+        entry = self._entry(version, payload)
+        if self._generations.current((key[0],)) == generation:
+            self._store_local(key, entry)
+            if self.store is not None:
+                self.store.set(self._shared_key(key, version), payload, FIGURE_CACHE_TTL, len(payload),
+                               tables=(key[0],))
+        self._record(key[0], 'build', time.perf_counter() - start, len(payload))
+        return entry
+
+    def _load_shared(self, key, version):
+        if self.store is None:
+            return None
+        payload = self.store.get(self._shared_key(key, version))
+        if payload is None:
+            return None
+        self._record(key[0], 'shared', 0.0)
+        return self._store_local(key, self._entry(version, payload))
+
+    @staticmethod
+    def _entry(version, payload) -> dict:
+        return {'version': version, 'payload': payload, 'figure': json.loads(payload)}
+
+    def _store_local(self, key, entry) -> dict:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._build_locks.pop(evicted, None)
+        return entry
+
+    @staticmethod
+    def _shared_key(key, version) -> str:
+        chart_id, variant = key
+        return hashlib.sha1(json.dumps([chart_id, variant, version], default=str).encode('utf-8')).hexdigest()
+
+    def _build_lock(self, key):
+        with self._lock:
+            return self._build_locks.setdefault(key, threading.Lock())
+
+    def _record(self, chart_id, kind, seconds, payload_bytes=None):
+        with self._lock:
+            stats = self._stats.setdefault(chart_id, {'builds': 0, 'build_ms_total': 0.0, 'build_ms_last': 0.0,
+                                                      'serves': 0, 'serve_ms_total': 0.0, 'payload_bytes': 0,
+                                                      'shared_loads': 0})
+            ms = seconds * 1000
+            if kind == 'build':
+                stats['builds'] += 1
+                stats['build_ms_total'] += ms
+                stats['build_ms_last'] = ms
+                stats['payload_bytes'] = payload_bytes
+            elif kind == 'shared':
+                stats['shared_loads'] += 1  # tomada de la caché compartida, construida por otro proceso
+            else:
+                stats['serves'] += 1
+                stats['serve_ms_total'] += ms
+
+
+# Con CACHE_BACKEND=sqlite las figuras se comparten entre los workers
+figure_cache = FigureCache(store=db_utils.create_cache_backend('figures', max_entries=FIGURE_CACHE_MAX_ENTRIES)
+                           if db_utils.CACHE_BACKEND == 'sqlite' else None)
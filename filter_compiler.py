@@ -0,0 +1,360 @@
+import logging
+import re
+from datetime import date
+
+# Tipos de information_schema.COLUMNS.DATA_TYPE agrupados por cómo se comparan
+NUMERIC_TYPES = {'tinyint', 'smallint', 'mediumint', 'int', 'integer', 'bigint',
+                 'decimal', 'numeric', 'float', 'double', 'real', 'year', 'bit'}
+DATE_TYPES = {'date', 'datetime', 'timestamp'}
+
+logger = logging.getLogger(__name__)
+
+# Operadores del filtro de dash_table (con sus alias en palabras) -> operador SQL
+COMPARISON_OPERATORS = {
+    '=': '=', 'eq': '=',
+    '!=': '<>', 'ne': '<>',
+    '<': '<', 'lt': '<',
+    '<=': '<=', 'le': '<=',
+    '>': '>', 'gt': '>',
+    '>=': '>=', 'ge': '>=',
+}
+LIKE_OPERATORS = {'contains', 'datestartswith'}
+UNARY_OPERATORS = {'blank', 'nil', 'even', 'odd'}
+
+TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+      (?P<column>\{(?:[^{}\\]|\\.)*\})               # {columna}
+    | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|`(?:[^`\\]|\\.)*`)
+    | (?P<logical>&&|\|\||\band\b|\bor\b)
+    | (?P<paren>[()])
+    | (?P<not>!(?!=))
+    | (?P<symbol><=|>=|!=|=|<|>)
+    | (?P<word>[^\s(){}"'`&|<>=!]+)
+    )""", re.VERBOSE | re.IGNORECASE)
+
+
+class FilterSyntaxError(ValueError):
+    pass
+
+
+def column_kind(data_type) -> str:
+    """'numeric', 'datetime' o 'text' según el DATA_TYPE de la columna."""
+    data_type = (data_type or '').lower()
+    if data_type in NUMERIC_TYPES:
+        return 'numeric'
+    if data_type in DATE_TYPES:
+        return 'datetime'
+    return 'text'
+
+
+class FilterCompiler:
+    """
+    Traduce la gramática de filtros de dash_table a SQL parametrizado.
+
+    Soporta expresiones relacionales ({col} op valor, con los prefijos 'i'/'s'
+    de mayúsculas), los unarios 'is blank/nil/even/odd', '!' y la combinación
+    con &&/|| y paréntesis. Los valores se convierten al tipo de la columna y,
+    siempre que se puede, se generan predicados que aprovechan índices:
+    igualdades y rangos sobre el valor tipado y LIKE 'x%' (o un rango de
+    fechas) para datestartswith. Solo 'contains' necesita LIKE '%x%'.
+    `dialect` ('mariadb' o 'sqlite') decide la sintaxis de las comparaciones
+    sensibles a mayúsculas y del escape de LIKE.
+    """
+    def __init__(self, valid_columns, column_types: dict = None, param_prefix: str = 'filter_param_',
+                 dialect: str = 'mariadb'):
+        self.valid_columns = set(valid_columns)
+        self.column_types = column_types or {}
+        self.param_prefix = param_prefix
+        self.dialect = dialect
+
+    def compile(self, query_string: str):
+        self.params = {}
+        self._tokens = []
+        where_parts = []
+        if query_string and query_string.strip():
+            # Las partes unidas por && se compilan por separado para que una
+            # parte inválida no anule el resto del filtro
+            for part in split_top_level_and(query_string):
+                try:
+                    self._tokens = tokenize(part)
+                    self._pos = 0
+                    sql = self._expression()
+                    if self._pos != len(self._tokens):
+                        raise FilterSyntaxError(f"texto inesperado en '{part}'")
+                except FilterSyntaxError as e:
+                    logger.warning("Filtro ignorado (%s).", e)
+                    continue
+                if sql is not None:
+                    where_parts.append(sql)
+        where_clause = " AND ".join(where_parts) if where_parts else "1=1"
+        return where_clause, self.params
+
+    # Gramática: expr := term (|| term)* ; term := factor (&& factor)* ;
+    # factor := '!' factor | '(' expr ')' | relacional
+    def _expression(self):
+        parts = [self._term()]
+        while self._peek('logical') and self._peek_value().lower() in ('||', 'or'):
+            self._pos += 1
+            parts.append(self._term())
+        return _join(parts, 'OR')
+
+    def _term(self):
+        parts = [self._factor()]
+        while self._peek('logical') and self._peek_value().lower() in ('&&', 'and'):
+            self._pos += 1
+            parts.append(self._factor())
+        return _join(parts, 'AND')
+
+    def _factor(self):
+        if self._peek('not'):
+            self._pos += 1
+            inner = self._factor()
+            return None if inner is None else f"NOT ({inner})"
+        if self._peek('paren') and self._peek_value() == '(':
+            self._pos += 1
+            inner = self._expression()
+            if not (self._peek('paren') and self._peek_value() == ')'):
+                raise FilterSyntaxError("falta ')'")
+            self._pos += 1
+            return inner
+        return self._relational()
+
+    def _relational(self):
+        column = self._take_column()
+        operator = self._take_operator()
+        if operator == 'is':
+            negate = False
+            if self._peek('word') and self._peek_value().lower() == 'not':
+                self._pos += 1
+                negate = True
+            if not self._peek('word'):
+                raise FilterSyntaxError("falta el operador tras 'is'")
+            unary = self._take()[1].lower()
+            sql = self._unary(column, unary)
+            return None if sql is None else (f"NOT ({sql})" if negate else sql)
+        value = self._take_value()
+        if column is None:
+            return None
+        return self._comparison(column, operator, value)
+
+    def _take_column(self):
+        kind, value = self._take()
+        if kind == 'column':
+            name = value[1:-1].replace('\\', '')
+        elif kind in ('word', 'string'):
+            name = _unquote(value) if kind == 'string' else value
+        else:
+            raise FilterSyntaxError(f"se esperaba una columna y se encontró '{value}'")
+        if name not in self.valid_columns:
+            logger.warning("Columna de filtro inválida '%s'.", name)
+            return None
+        return name
+
+    def _take_operator(self):
+        kind, value = self._take()
+        operator = value.lower()
+        if kind == 'symbol' or operator == 'is':
+            return operator
+        if kind == 'word':
+            base = operator[1:] if operator[:1] in ('i', 's') and operator[1:] in _ALL_OPERATORS else operator
+            if base in _ALL_OPERATORS:
+                return operator
+            # Prefijos de mayúsculas sobre símbolos: s=, i<, s!= ...
+            if operator in ('s', 'i') and self._peek('symbol'):
+                return operator + self._take()[1]
+        raise FilterSyntaxError(f"operador no soportado '{value}'")
+
+    def _take_value(self):
+        kind, value = self._take()
+        if kind == 'string':
+            return _unquote(value)
+        if kind == 'word':
+            return value
+        raise FilterSyntaxError(f"se esperaba un valor y se encontró '{value}'")
+
+    def _comparison(self, column, operator, raw_value):
+        case_sensitive = operator.startswith('s') and operator[1:] in _ALL_OPERATORS
+        base = operator[1:] if operator[:1] in ('i', 's') and operator[1:] in _ALL_OPERATORS else operator
+        kind = column_kind(self.column_types.get(column))
+        quoted = f"`{column}`"
+
+        if base == 'contains':
+            if case_sensitive and self.dialect == 'sqlite':
+                # El LIKE de SQLite no distingue mayúsculas; instr() sí y no necesita escapes
+                return f"instr({quoted}, :{self._param(str(raw_value))}) > 0"
+            param = self._param(f"%{escape_like(str(raw_value))}%")
+            if case_sensitive:
+                return case_sensitive_like(quoted, param)
+            return f"{quoted} LIKE :{param}{like_escape(self.dialect)}"
+
+        if base == 'datestartswith':
+            prefix = str(raw_value)
+            if kind == 'datetime':
+                bounds = date_prefix_range(prefix)
+                if bounds is not None:
+                    start, end = self._param(bounds[0]), self._param(bounds[1])
+                    return f"({quoted} >= :{start} AND {quoted} < :{end})"
+            param = self._param(f"{escape_like(prefix)}%")
+            return f"{quoted} LIKE :{param}{like_escape(self.dialect)}"
+
+        sql_operator = COMPARISON_OPERATORS[base]
+        value = coerce_value(raw_value, kind)
+        if value is None:
+            # Un valor no numérico sobre una columna numérica no puede coincidir
+            return "1=0" if sql_operator != '<>' else f"{quoted} IS NOT NULL"
+        param = self._param(value)
+        if case_sensitive and kind == 'text' and sql_operator == '=':
+            # Igualdad sargable con la colación de la columna y comprobación binaria encima
+            if self.dialect == 'sqlite':
+                return f"({quoted} = :{param} AND {quoted} = :{param} COLLATE BINARY)"
+            return f"({quoted} = :{param} AND {case_sensitive_equals(quoted, param)})"
+        if kind == 'text' and self.dialect == 'sqlite':
+            # Igual que la colación _ci de MariaDB aunque la columna se creara con BINARY
+            return f"{quoted} {sql_operator} :{param} COLLATE {'BINARY' if case_sensitive else 'NOCASE'}"
+        return f"{quoted} {sql_operator} :{param}"
+
+    def _unary(self, column, unary):
+        if unary not in UNARY_OPERATORS:
+            raise FilterSyntaxError(f"operador no soportado 'is {unary}'")
+        if column is None:
+            return None
+        quoted = f"`{column}`"
+        if unary == 'nil':
+            return f"{quoted} IS NULL"
+        if unary == 'blank':
+            if column_kind(self.column_types.get(column)) == 'text':
+                return f"({quoted} IS NULL OR {quoted} = '')"
+            return f"{quoted} IS NULL"
+        remainder = 0 if unary == 'even' else 1
+        # '%' en lugar de MOD(), que SQLite no tiene
+        return f"{quoted} % 2 = {remainder}"
+
+    def _param(self, value) -> str:
+        name = f"{self.param_prefix}{len(self.params)}"
+        self.params[name] = value
+        return name
+
+    def _peek(self, kind) -> bool:
+        return self._pos < len(self._tokens) and self._tokens[self._pos][0] == kind
+
+    def _peek_value(self) -> str:
+        return self._tokens[self._pos][1]
+
+    def _take(self):
+        if self._pos >= len(self._tokens):
+            raise FilterSyntaxError("expresión incompleta")
+        token = self._tokens[self._pos]
+        self._pos += 1
+        return token
+
+
+_ALL_OPERATORS = set(COMPARISON_OPERATORS) | LIKE_OPERATORS
+
+
+def tokenize(text: str) -> list:
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN_PATTERN.match(text, position)
+        if match is None or match.end() == position:
+            raise FilterSyntaxError(f"no se entiende '{text[position:]}'")
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        position = match.end()
+    return tokens
+
+
+def split_top_level_and(query_string: str) -> list:
+    """Divide por ' && ' fuera de comillas y paréntesis."""
+    parts, depth, current, quote = [], 0, [], None
+    i = 0
+    while i < len(query_string):
+        char = query_string[i]
+        if quote:
+            current.append(char)
+            if char == '\\' and i + 1 < len(query_string):
+                current.append(query_string[i + 1])
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in '"\'`':
+            quote = char
+            current.append(char)
+        elif char == '(':
+            depth += 1
+            current.append(char)
+        elif char == ')':
+            depth -= 1
+            current.append(char)
+        elif depth == 0 and query_string.startswith('&&', i):
+            parts.append(''.join(current))
+            current = []
+            i += 1
+        else:
+            current.append(char)
+        i += 1
+    parts.append(''.join(current))
+    return [part.strip() for part in parts if part.strip()]
+
+
+def coerce_value(raw_value, kind: str):
+    """Convierte el valor del filtro al tipo de la columna (None si no es posible)."""
+    text = str(raw_value).strip()
+    if kind == 'numeric':
+        try:
+            number = float(text)
+        except ValueError:
+            return None
+        return int(number) if number.is_integer() and 'e' not in text.lower() and '.' not in text else number
+    return text
+
+
+def date_prefix_range(prefix: str):
+    """'2020' -> ('2020-01-01', '2021-01-01'); '2020-03' y '2020-03-05' igual. None si no es una fecha."""
+    match = re.fullmatch(r"(\d{4})(?:-(\d{1,2})(?:-(\d{1,2}))?)?", prefix.strip())
+    if not match:
+        return None
+    year, month, day = match.groups()
+    try:
+        if day:
+            start = date(int(year), int(month), int(day))
+            end = date.fromordinal(start.toordinal() + 1)
+        elif month:
+            start = date(int(year), int(month), 1)
+            end = date(start.year + (start.month == 12), start.month % 12 + 1, 1)
+        else:
+            start = date(int(year), 1, 1)
+            end = date(int(year) + 1, 1, 1)
+    except ValueError:
+        return None
+    return start.isoformat(), end.isoformat()
+
+
+def escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def like_escape(dialect: str) -> str:
+    # MariaDB usa '\\' como escape de LIKE por defecto; SQLite no tiene escape salvo que se declare
+    return " ESCAPE '\\'" if dialect == 'sqlite' else ""
+
+
+def case_sensitive_equals(quoted_column: str, param: str) -> str:
+    return f"BINARY {quoted_column} = :{param}"
+
+
+def case_sensitive_like(quoted_column: str, param: str) -> str:
+    return f"{quoted_column} LIKE BINARY :{param}"
+
+
+def _unquote(value: str) -> str:
+    return re.sub(r"\\(.)", r"\1", value[1:-1])
+
+
+def _join(parts, operator):
+    parts = [part for part in parts if part is not None]
+    if not parts:
+        return None
+    if len(parts) == 1:
+        return parts[0]
+    return "(" + f" {operator} ".join(parts) + ")"
@@ -0,0 +1,36 @@
+# Configuración de gunicorn para producción: `gunicorn` en este directorio.
+# Variables: WEB_BIND, WEB_CONCURRENCY (workers), WEB_THREADS, WEB_TIMEOUT,
+# WEB_MAX_REQUESTS. Ver serving.py.
+import multiprocessing
+import os
+
+wsgi_app = 'app:server'
+bind = os.getenv('WEB_BIND', '0.0.0.0:8050')
+workers = int(os.getenv('WEB_CONCURRENCY', str(multiprocessing.cpu_count())))
+threads = int(os.getenv('WEB_THREADS', '4'))
+worker_class = 'gthread'
+timeout = int(os.getenv('WEB_TIMEOUT', '60'))
+graceful_timeout = 30
+keepalive = 5
+# Reciclar workers cada N peticiones (0 = nunca); los nuevos salen ya calientes del maestro
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+
+# La app se importa una vez en el maestro: esquema, callbacks y cachés se heredan con fork
+preload_app = True
+
+
+def when_ready(server):
+    import serving
+    serving.prepare_master()
+
+
+def on_reload(server):
+    # HUP: se actualizan las cachés del maestro antes de crear los workers nuevos
+    import serving
+    serving.prepare_master()
+
+
+def post_fork(server, worker):
+    import serving
+    serving.after_fork()
@@ -0,0 +1,327 @@
+"""
+Instrumentación de la aplicación: logging asíncrono, métricas de cada
+callback de Dash y de cada consulta SQL, y registro de consultas lentas.
+
+El logging lo configura el punto de entrada de la aplicación (app.py, que
+también usa Gunicorn) llamando a setup_logging(); importar los módulos de
+datos no toca el logger raíz, así que los scripts (embedded.py,
+load_dump.py) y los benchmarks conservan el suyo. Los registros van a una
+cola y un hilo aparte (QueueListener) los escribe en stderr, de modo que
+quien registra no espera nunca a la E/S. LOG_FORMAT=json los escribe como JSON,
+con los campos de `extra` incluidos.
+
+Por cada petición a /_dash-update-component se acumulan, en un contexto que
+también siguen los hilos de query_executor, el tiempo de base de datos, las
+consultas, las filas devueltas y los aciertos/fallos de caché; al responder
+se añaden el tiempo total y los bytes de la respuesta a los histogramas del
+callback. Las consultas que superan SLOW_QUERY_MS se guardan junto con su
+plan de ejecución (EXPLAIN), que se obtiene en segundo plano; sus
+parámetros solo se guardan si SLOW_QUERY_LOG_PARAMS está activado.
+"""
+import atexit
+import contextvars
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()  # 'text' o 'json'
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '500'))
+SLOW_QUERY_LOG_SIZE = int(os.getenv('SLOW_QUERY_LOG_SIZE', '100'))
+SLOW_QUERY_EXPLAIN = os.getenv('SLOW_QUERY_EXPLAIN', 'true').lower() in ('1', 'true', 'yes')
+# Los valores de los parámetros son datos de usuario (filtros): por defecto solo se guardan sus nombres
+SLOW_QUERY_LOG_PARAMS = os.getenv('SLOW_QUERY_LOG_PARAMS', 'false').lower() in ('1', 'true', 'yes')
+
+MAX_METRIC_KEYS = 500  # consultas distintas con histograma propio; el resto se agrupa en 'otras'
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+SIZE_BUCKETS_BYTES = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+logger = logging.getLogger(__name__)
+
+
+# Logging asíncrono
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro con los campos estándar y los de `extra`."""
+    _STANDARD = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        data = {'time': self.formatTime(record), 'level': record.levelname,
+                'logger': record.name, 'message': record.getMessage()}
+        data.update({key: value for key, value in vars(record).items() if key not in self._STANDARD})
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+_listener = None
+
+
+def setup_logging():
+    """Conecta el logger raíz a una cola atendida por un hilo escritor (idempotente)."""
+    global _listener
+    if _listener is not None:
+        return
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(name)s] %(message)s'))
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(LOG_LEVEL)
+
+
+def reset_after_fork():
+    """
+    En un worker creado con fork el hilo escritor no existe: se sustituye la
+    cola heredada por una nueva con su propio hilo, se crea el hilo de EXPLAIN
+    y se empiezan métricas propias del worker.
+    """
+    global _listener
+    if _listener is not None:
+        root = logging.getLogger()
+        for handler in [h for h in root.handlers if isinstance(h, logging.handlers.QueueHandler)]:
+            root.removeHandler(handler)
+        _listener = None
+        setup_logging()
+    metrics.reset_after_fork()
+
+
+# Histogramas
+
+class Histogram:
+    """Histograma de cubetas fijas; los percentiles se aproximan con el límite superior de la cubeta."""
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, fraction: float) -> float:
+        if not self.count:
+            return 0.0
+        target, seen = fraction * self.count, 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self) -> dict:
+        buckets = {f"le_{bound}": count for bound, count in zip(self.buckets, self.counts)}
+        buckets['inf'] = self.counts[-1]
+        return {'count': self.count, 'sum': self.total, 'mean': self.total / self.count if self.count else 0.0,
+                'max': self.max, 'p50': self.quantile(0.50), 'p95': self.quantile(0.95),
+                'p99': self.quantile(0.99), 'buckets': buckets}
+
+
+# Métricas por petición
+
+class RequestMetrics:
+    """Lo que ocurre durante un callback, incluidas las consultas lanzadas en otros hilos."""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_ms = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._lock = threading.Lock()
+
+    def add_query(self, ms: float, rows: int):
+        with self._lock:
+            self.db_ms += ms
+            self.queries += 1
+            self.rows += rows or 0
+
+    def add_cache(self, hit: bool):
+        with self._lock:
+            if hit: self.cache_hits += 1
+            else: self.cache_misses += 1
+
+
+_current_request = contextvars.ContextVar('instrumentation_request', default=None)
+
+
+def record_cache(hit: bool):
+    """Acierto o fallo de una caché (resultados, figuras, conteos) dentro del callback en curso."""
+    current = _current_request.get()
+    if current is not None:
+        current.add_cache(hit)
+
+
+class MetricsRegistry:
+    """Histogramas agregados por callback y por consulta, más el registro de consultas lentas."""
+    def __init__(self, slow_query_ms: float = SLOW_QUERY_MS, slow_log_size: int = SLOW_QUERY_LOG_SIZE):
+        self.slow_query_ms = slow_query_ms
+        self._callbacks = {}
+        self._queries = OrderedDict()
+        self._slow = deque(maxlen=slow_log_size)
+        self._plans = OrderedDict()  # huella de la consulta -> plan ya capturado
+        self._explain_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='explain')
+        self._lock = threading.Lock()
+
+    def record_callback(self, name: str, wall_ms: float, request_metrics: RequestMetrics,
+                        payload_bytes: int, status: int):
+        with self._lock:
+            stats = self._callbacks.get(name)
+            if stats is None:
+                stats = self._callbacks[name] = {
+                    'calls': 0, 'errors': 0, 'queries': 0, 'rows': 0, 'cache_hits': 0, 'cache_misses': 0,
+                    'wall_ms': Histogram(), 'db_ms': Histogram(), 'payload_bytes': Histogram(SIZE_BUCKETS_BYTES)}
+            stats['calls'] += 1
+            stats['errors'] += status >= 400
+            stats['queries'] += request_metrics.queries
+            stats['rows'] += request_metrics.rows
+            stats['cache_hits'] += request_metrics.cache_hits
+            stats['cache_misses'] += request_metrics.cache_misses
+            stats['wall_ms'].observe(wall_ms)
+            stats['db_ms'].observe(request_metrics.db_ms)
+            stats['payload_bytes'].observe(payload_bytes)
+
+    def record_query(self, query: str, params: dict, seconds: float, rows: int, engine=None):
+        ms = seconds * 1000
+        sql = " ".join(query.split()).rstrip(';')
+        fingerprint = hashlib.sha1(sql.encode('utf-8')).hexdigest()[:12]
+        current = _current_request.get()
+        if current is not None:
+            current.add_query(ms, rows)
+        with self._lock:
+            stats = self._queries.get(fingerprint)
+            if stats is None:
+                if len(self._queries) >= MAX_METRIC_KEYS:
+                    fingerprint, sql = 'otras', '(otras consultas)'
+                    stats = self._queries.get(fingerprint)
+                if stats is None:
+                    stats = self._queries[fingerprint] = {'sql': sql[:500], 'rows': 0, 'ms': Histogram()}
+            stats['rows'] += rows or 0
+            stats['ms'].observe(ms)
+        if ms >= self.slow_query_ms:
+            self._record_slow(sql, params, ms, rows, fingerprint, engine)
+
+    def _record_slow(self, sql, params, ms, rows, fingerprint, engine):
+        entry = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'ms': round(ms, 2), 'rows': rows,
+                 'sql': sql, 'params': {k: str(v) if SLOW_QUERY_LOG_PARAMS else '?' for k, v in (params or {}).items()},
+                 'fingerprint': fingerprint, 'plan': None}
+        with self._lock:
+            self._slow.append(entry)
+            entry['plan'] = self._plans.get(fingerprint)
+        logger.warning("Consulta lenta (%.1f ms, %s filas): %s", ms, rows, sql[:300],
+                       extra={'query_ms': round(ms, 2), 'rows': rows, 'fingerprint': fingerprint})
+        if SLOW_QUERY_EXPLAIN and engine is not None and entry['plan'] is None:
+            # El plan se obtiene fuera de la petición que ya ha sido lenta
+            self._explain_pool.submit(self._explain, engine, sql, params, entry)
+
+    def _explain(self, engine, sql, params, entry):
+        from sqlalchemy import text
+        prefix = "EXPLAIN QUERY PLAN" if engine.dialect.name == 'sqlite' else "EXPLAIN"
+        try:
+            with engine.connect() as connection:
+                result = connection.execute(text(f"{prefix} {sql}"), params or {})
+                plan = [dict(zip(result.keys(), (str(v) for v in row))) for row in result]
+        except Exception as e:
+            plan = [{'error': str(e)}]
+        with self._lock:
+            entry['plan'] = plan
+            self._plans[entry['fingerprint']] = plan
+            while len(self._plans) > SLOW_QUERY_LOG_SIZE:
+                self._plans.popitem(last=False)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            callbacks = {name: {key: value.snapshot() if isinstance(value, Histogram) else value
+                                for key, value in stats.items()} for name, stats in self._callbacks.items()}
+            queries = {fingerprint: {'sql': stats['sql'], 'rows': stats['rows'], 'ms': stats['ms'].snapshot()}
+                       for fingerprint, stats in self._queries.items()}
+        return {'callbacks': callbacks, 'queries': queries}
+
+    def slow_queries(self) -> list:
+        with self._lock:
+            return [dict(entry) for entry in reversed(self._slow)]
+
+    def reset(self):
+        with self._lock:
+            self._callbacks.clear()
+            self._queries.clear()
+            self._slow.clear()
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+        self._explain_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='explain')
+        self.reset()
+
+
+metrics = MetricsRegistry()
+
+
+def record_query(query: str, params: dict, seconds: float, rows: int, engine=None):
+    metrics.record_query(query, params, seconds, rows, engine)
+
+
+# Hooks de Flask
+
+def callback_name(body: dict) -> str:
+    """'graph-top-cities.figure' o, con ids de patrón, 'dynamic-table.data' (primera salida)."""
+    outputs = body.get('outputs') if isinstance(body, dict) else None
+    if isinstance(outputs, list):
+        outputs = outputs[0] if outputs else None
+    if not isinstance(outputs, dict):
+        return str(body.get('output', 'desconocido')) if isinstance(body, dict) else 'desconocido'
+    component_id = outputs.get('id')
+    if isinstance(component_id, dict):
+        component_id = component_id.get('type', json.dumps(component_id, sort_keys=True))
+    return f"{component_id}.{outputs.get('property')}"
+
+
+def register(server):
+    """Mide cada petición de callback de Dash en el servidor Flask."""
+    from flask import g, request
+
+    @server.before_request
+    def start_callback_metrics():
+        if request.path.endswith('/_dash-update-component'):
+            g.instrumentation_token = _current_request.set(RequestMetrics())
+
+    @server.after_request
+    def finish_callback_metrics(response):
+        current = _current_request.get()
+        if current is None or not request.path.endswith('/_dash-update-component'):
+            return response
+        wall_ms = (time.perf_counter() - current.started) * 1000
+        payload_bytes = response.calculate_content_length() or 0
+        name = callback_name(request.get_json(silent=True) or {})
+        metrics.record_callback(name, wall_ms, current, payload_bytes, response.status_code)
+        logger.debug("Callback %s: %.1f ms (BD %.1f ms, %d consultas, %d filas, %d bytes)",
+                     name, wall_ms, current.db_ms, current.queries, current.rows, payload_bytes,
+                     extra={'callback': name, 'wall_ms': round(wall_ms, 2), 'db_ms': round(current.db_ms, 2),
+                            'queries': current.queries, 'rows': current.rows, 'payload_bytes': payload_bytes,
+                            'cache_hits': current.cache_hits, 'cache_misses': current.cache_misses,
+                            'status': response.status_code})
+        return response
+
+    @server.teardown_request
+    def clear_callback_metrics(exception=None):
+        token = g.pop('instrumentation_token', None)
+        if token is not None:
+            _current_request.reset(token)
@@ -0,0 +1,262 @@
+"""
+Carga rápida de volcados de mysqldump (world.sql y similares).
+
+El volcado se lee en streaming, sentencia a sentencia, y las filas de los
+INSERT se agrupan en lotes de --batch-size filas antes de escribirlas. Los
+índices secundarios se desactivan durante la carga y se reconstruyen al
+final. Al terminar se muestran las filas/s de cada tabla y del total.
+
+Uso:
+    python load_dump.py world.sql --target sqlite --output world.db
+    python load_dump.py world.sql --target mariadb                     (base de datos de .env)
+    python load_dump.py world.sql --target mariadb --method infile     (LOAD DATA LOCAL INFILE)
+"""
+import argparse
+import logging
+import os
+import re
+import tempfile
+import time
+
+LOAD_BATCH_SIZE = int(os.getenv('LOAD_BATCH_SIZE', '5000'))
+
+CREATE_TABLE = re.compile(r"CREATE TABLE `(\w+)` \((.*)\)[^)]*$", re.DOTALL)
+INSERT_INTO = re.compile(r"INSERT INTO `(\w+)`(?:\s*\(([^)]*)\))?\s+VALUES\s*", re.IGNORECASE)
+# Cadena de MySQL entre comillas simples, con escapes \x y ''
+STRING_LITERAL = r"'(?:[^'\\]|\\.|'')*'"
+# Una tupla completa de VALUES y, dentro de ella, cada campo (cadena entre comillas u otro literal)
+ROW_PATTERN = re.compile(rf"\(((?:[^()']|{STRING_LITERAL})*)\)")
+FIELD_PATTERN = re.compile(r"\s*(?:'((?:[^'\\]|\\.|'')*)'|([^,]+?))\s*(?:,|$)")
+# Lo que queda fuera de las cadenas: una comilla suelta indica una cadena sin cerrar
+OUTSIDE_STRINGS = re.compile(rf"{STRING_LITERAL}|'")
+MYSQL_ESCAPES = {'0': '\0', 'b': '\b', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a'}
+
+
+# Lectura del volcado
+
+def iter_dump_statements(dump_path: str):
+    """
+    Sentencias CREATE TABLE e INSERT del volcado, leído línea a línea (el
+    resto se ignora). Una línea que acaba en ';' solo cierra la sentencia si
+    no queda dentro de una cadena: un valor con ';' y salto de línea no la corta.
+    """
+    statement = []
+    with open(dump_path, encoding='utf-8') as dump:
+        for line in dump:
+            if not statement:
+                if not (line.startswith('CREATE TABLE') or line.startswith('INSERT INTO')):
+                    continue
+            statement.append(line)
+            if line.rstrip().endswith(';'):
+                text = ''.join(statement)
+                if in_string(text):
+                    continue
+                yield text
+                statement = []
+
+
+def in_string(text: str) -> bool:
+    """True si `text` termina dentro de una cadena entre comillas simples."""
+    if '\\' not in text:
+        # Sin escapes con barra ('' cuenta doble) basta la paridad de las comillas
+        return text.count("'") % 2 == 1
+    return any(match.group() == "'" for match in OUTSIDE_STRINGS.finditer(text))
+
+
+def table_name_of(create_statement: str) -> str:
+    match = CREATE_TABLE.search(create_statement.strip().rstrip(';'))
+    if not match:
+        raise ValueError("CREATE TABLE no reconocido")
+    return match.group(1)
+
+
+def parse_insert(statement: str):
+    """Devuelve (tabla, columnas o None, generador de tuplas) de un INSERT INTO ... VALUES (...),(...);"""
+    match = INSERT_INTO.match(statement)
+    if not match:
+        raise ValueError("INSERT no reconocido")
+    table_name, columns = match.groups()
+    columns = [c.strip().strip('`') for c in columns.split(',')] if columns else None
+    return table_name, columns, iter_values(statement, match.end())
+
+
+def iter_values(text: str, position: int = 0):
+    """
+    Genera las tuplas de VALUES (...),(...) convirtiendo NULL, números, hex y
+    cadenas con escapes de MySQL. Cada tupla se divide en campos con una sola
+    expresión regular, sin recorrer el texto carácter a carácter.
+    """
+    for row in ROW_PATTERN.finditer(text, position):
+        yield tuple(convert_literal(literal) if literal else unescape_mysql(string)
+                    for string, literal in FIELD_PATTERN.findall(row.group(1)))
+
+
+def convert_literal(literal: str):
+    if literal == 'NULL':
+        return None
+    if literal[:2] in ('0x', '0X'):
+        return bytes.fromhex(literal[2:])
+    return float(literal) if any(c in literal for c in '.eE') else int(literal)
+
+
+def unescape_mysql(value: str) -> str:
+    if '\\' not in value and "''" not in value:
+        return value
+    return re.sub(r"\\(.)|''", lambda m: "'" if m.group(1) is None else MYSQL_ESCAPES.get(m.group(1), m.group(1)), value)
+
+
+# Carga
+
+class LoadStats:
+    """Filas y tiempo de carga por tabla."""
+    def __init__(self):
+        self.rows = {}
+        self.seconds = {}
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def add(self, table_name: str, rows: int, seconds: float):
+        self.rows[table_name] = self.rows.get(table_name, 0) + rows
+        self.seconds[table_name] = self.seconds.get(table_name, 0.0) + seconds
+
+    @property
+    def total_rows(self) -> int:
+        return sum(self.rows.values())
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    def report(self) -> str:
+        lines = []
+        for table_name, rows in self.rows.items():
+            seconds = self.seconds[table_name]
+            lines.append(f"  {table_name}: {rows} filas, {rows / seconds if seconds else 0:,.0f} filas/s")
+        rate = self.total_rows / self.elapsed if self.elapsed else 0
+        lines.append(f"Total: {self.total_rows} filas en {self.elapsed:.2f} s ({rate:,.0f} filas/s)")
+        return "\n".join(lines)
+
+
+def load_dump(dump_path: str, target, batch_size: int = LOAD_BATCH_SIZE) -> LoadStats:
+    """
+    Carga el volcado en `target` (ver MariaDBTarget y embedded.SQLiteTarget).
+    Las filas se envían en lotes de `batch_size`; un lote puede reunir
+    filas de varios INSERT consecutivos sobre la misma tabla.
+    """
+    stats = LoadStats()
+    batch, batch_table, batch_columns = [], None, None
+
+    def flush():
+        if batch:
+            start = time.perf_counter()
+            target.insert_rows(batch_table, batch_columns, batch)
+            stats.add(batch_table, len(batch), time.perf_counter() - start)
+            batch.clear()
+
+    try:
+        for statement in iter_dump_statements(dump_path):
+            if statement.startswith('CREATE TABLE'):
+                flush()
+                target.create_table(table_name_of(statement), statement)
+                continue
+            table_name, columns, rows = parse_insert(statement)
+            if table_name != batch_table or columns != batch_columns:
+                flush()
+                batch_table, batch_columns = table_name, columns
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    flush()
+        flush()
+        target.finish()
+    finally:
+        target.close()
+    stats.finish()
+    return stats
+
+
+class MariaDBTarget:
+    """
+    Destino MariaDB/MySQL. Durante la carga se desactivan las comprobaciones
+    de unicidad y de claves foráneas y los índices no únicos (DISABLE KEYS);
+    todo se confirma en una transacción al final. Con method='infile' cada
+    lote se escribe en un fichero temporal y se envía con LOAD DATA LOCAL
+    INFILE (el servidor debe permitir local_infile).
+    """
+    def __init__(self, engine, method: str = 'insert'):
+        self.method = method
+        self.connection = engine.raw_connection()
+        self.cursor = self.connection.cursor()
+        self.tables = []
+        self.cursor.execute("SET SESSION unique_checks = 0")
+        self.cursor.execute("SET SESSION foreign_key_checks = 0")
+
+    def create_table(self, table_name: str, statement: str):
+        self.cursor.execute(f"DROP TABLE IF EXISTS `{table_name}`")
+        self.cursor.execute(statement.strip().rstrip(';'))
+        self.cursor.execute(f"ALTER TABLE `{table_name}` DISABLE KEYS")
+        self.tables.append(table_name)
+
+    def insert_rows(self, table_name: str, columns, rows: list):
+        column_list = f" ({', '.join(f'`{c}`' for c in columns)})" if columns else ""
+        if self.method == 'infile':
+            self._load_infile(table_name, column_list, rows)
+            return
+        placeholders = ", ".join("?" * len(rows[0]))
+        self.cursor.executemany(f"INSERT INTO `{table_name}`{column_list} VALUES ({placeholders})", rows)
+
+    def _load_infile(self, table_name, column_list, rows):
+        with tempfile.NamedTemporaryFile('w', suffix='.tsv', encoding='utf-8', newline='\n', delete=False) as data:
+            for row in rows:
+                data.write("\t".join(_tsv_value(value) for value in row) + "\n")
+        try:
+            self.cursor.execute(f"LOAD DATA LOCAL INFILE '{data.name}' INTO TABLE `{table_name}` "
+                                f"CHARACTER SET utf8mb4{column_list}")
+        finally:
+            os.remove(data.name)
+
+    def finish(self):
+        for table_name in self.tables:
+            self.cursor.execute(f"ALTER TABLE `{table_name}` ENABLE KEYS")
+        self.cursor.execute("SET SESSION unique_checks = 1")
+        self.cursor.execute("SET SESSION foreign_key_checks = 1")
+        self.connection.commit()
+
+    def close(self):
+        self.cursor.close()
+        self.connection.close()
+
+
+def _tsv_value(value) -> str:
+    # Formato por defecto de LOAD DATA: \N es NULL y tabuladores/saltos de línea se escapan
+    if value is None:
+        return "\\N"
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', errors='replace')
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('dump', help='volcado de mysqldump (p. ej. world.sql)')
+    parser.add_argument('--target', choices=('sqlite', 'mariadb'), default='sqlite')
+    parser.add_argument('--output', default='world.db', help='fichero SQLite a crear (--target sqlite)')
+    parser.add_argument('--method', choices=('insert', 'infile'), default='insert',
+                        help='inserción por lotes o LOAD DATA LOCAL INFILE (--target mariadb)')
+    parser.add_argument('--batch-size', type=int, default=LOAD_BATCH_SIZE)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    if args.target == 'sqlite':
+        import embedded
+        stats = embedded.build_from_dump(args.dump, args.output, batch_size=args.batch_size)
+    else:
+        from sqlalchemy import create_engine
+        import db_utils
+        engine = create_engine(db_utils.MARIADB_URI, connect_args={'local_infile': True} if args.method == 'infile' else {})
+        stats = load_dump(args.dump, MariaDBTarget(engine, args.method), args.batch_size)
+        print(f"Volcado {args.dump} cargado en {db_utils.DB_HOST}:{db_utils.DB_PORT}/{db_utils.DB_NAME}")
+    print(stats.report())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,34 @@
 import dash
-from dash import dcc, html, callback, Input, Output
+import logging
+import os
+import threading
+import time
+from dash import dcc, html, callback, ctx, Input, Output, State
 import plotly.express as px
-from db_utils import fetch_data
+import snapshot
+from data_reduction import budget_for, limit_rows, reduce_scatter, top_n_with_other
+from figure_cache import figure_cache
 
 # registrar la pagina como la ruta principal
 dash.register_page(__name__, path='/dashboard', name='Dashboard')
 
+logger = logging.getLogger(__name__)
+
+# Construir en segundo plano las figuras filtradas por cada continente
+DASHBOARD_PREWARM_FILTERS = os.getenv('DASHBOARD_PREWARM_FILTERS', 'true').lower() in ('1', 'true', 'yes')
+
 # definir el layout de la pagina
 def layout():
     return html.Div([
 
+        # Filtro cruzado: continente (clic en la tarta) y países (clic o selección en el mapa)
+        dcc.Store(id='dashboard-filter', data={}),
+        html.Div([
+            html.Span("Haz clic en un continente de la tarta o selecciona países en el mapa para filtrar el resto de gráficos.",
+                      id='dashboard-filter-status'),
+            html.Button("Quitar filtros", id='dashboard-filter-reset', n_clicks=0, className='boton-filtro'),
+        ], className='filtro-dashboard'),
+
         # Contenedor de gráficos 1
         html.Div([
             html.Div([
@@ -56,14 +75,215 @@ def layout():
         ], className='filas-principales')
     ], )
 
-# Callbacks de todos los gráficos
+# Callbacks de todos los gráficos (los datos salen del snapshot en memoria, sin consultas por gráfico)
+GRAFICOS = {}  # chart_id -> {'datos', 'constructor', 'tablas', 'ignorar', 'trazas', 'grupo', 'ajustar'}
+
+def grafico(chart_id, datos, tables=('country',), ignore=(), trazas=None, grupo=None, ajustar=None):
+    """
+    Registra el callback de `chart_id`. `datos(chart_id, filtro)` devuelve el
+    DataFrame del gráfico para el filtro cruzado (clave de snapshot.filter_key,
+    None sin filtro) y la función decorada construye con él la figura. El
+    callback la sirve desde figure_cache, con una entrada por filtro, y
+    únicamente la reconstruye cuando cambia la versión de alguna de las
+    tablas del snapshot que usa (`tables`). `ignore` son las dimensiones del
+    filtro que el propio gráfico origina.
+    Las variantes filtradas no pasan por plotly.express: se parte de la
+    figura sin filtro ya cacheada y se sustituyen los arrays de sus trazas
+    según `trazas` ({atributo: columna}, 'marker.size' para los anidados),
+    con una traza por valor de `grupo` si el gráfico colorea por esa columna.
+    `ajustar(figura, df)` corrige lo que plotly.express calcula a partir de
+    los datos (p. ej. la escala de tamaños).
+    """
+    def decorator(builder):
+        GRAFICOS[chart_id] = {'datos': datos, 'constructor': builder, 'tablas': tables, 'ignorar': ignore,
+                              'trazas': trazas, 'grupo': grupo, 'ajustar': ajustar}
+
+        @callback(Output(chart_id, 'figure'), Input('dashboard-filter', 'data'))
+        def servir_figura(filtro):
+            if not filtro:
+                programar_precalentado()
+            return figura(chart_id, filtro)
+        return builder
+    return decorator
+
+
+def figura(chart_id, filtro):
+    spec = GRAFICOS[chart_id]
+    key = snapshot.filter_key(filtro, spec['ignorar'])
+    # Con filtro, los países seleccionados salen de country aunque el gráfico no la use
+    tables = spec['tablas']
+    depends = tables if key is None or 'country' in tables else tables + ('country',)
+    version = snapshot.snapshot.current_version(depends)
+    return figure_cache.get(chart_id, version, lambda: construir(chart_id, key), variant=key)
+
+
+def construir(chart_id, filtro):
+    spec = GRAFICOS[chart_id]
+    df = spec['datos'](chart_id, filtro)
+    if filtro is None or spec['trazas'] is None:
+        return spec['constructor'](df, filtro)
+    base = figura(chart_id, None)
+    if not base.get('data'):
+        return spec['constructor'](df, filtro)
+    if df.empty:
+        # Sin filas para el filtro: la figura sin filtro vacía y con el aviso como título
+        layout = base.get('layout', {})
+        title = {**layout.get('title', {}), 'text': titulo_vacio(filtro, None)}
+        return {**base, 'data': [], 'layout': {**layout, 'title': title}}
+    return parchear(base, df, spec)
+
+
+def parchear(base, df, spec):
+    """
+    Variante filtrada: la figura sin filtro (dict de figure_cache, que no se
+    modifica) con los arrays de sus trazas calculados sobre `df`. Con `grupo`
+    hay una traza por valor en orden de aparición, como en plotly.express; los
+    valores que ya tenían traza conservan su color y los nuevos se crean a
+    partir de la primera traza con el siguiente color de la paleta.
+    """
+    trazas, grupo = spec['trazas'], spec['grupo']
+    if grupo is None:
+        data = [rellenar_traza(base['data'][0], df, trazas)]
+    else:
+        existentes = {str(trace.get('name')): trace for trace in base['data']}
+        colores = base.get('layout', {}).get('template', {}).get('layout', {}).get('colorway') or px.colors.qualitative.Plotly
+        data = []
+        for valor, parte in df.groupby(grupo, observed=True, sort=False):
+            trace = existentes.get(str(valor))
+            if trace is None:
+                color = colores[(len(existentes) + len(data)) % len(colores)]
+                trace = clonar_traza(base['data'][0], str(valor), color)
+            data.append(rellenar_traza(trace, parte, trazas))
+    fig = {**base, 'data': data}
+    if spec['ajustar'] is not None:
+        spec['ajustar'](fig, df)
+    return fig
+
+
+def rellenar_traza(trace, df, trazas):
+    trace = dict(trace)
+    for atributo, columna in trazas.items():
+        valores = df[columna].to_numpy()
+        if '.' in atributo:
+            padre, hijo = atributo.split('.', 1)
+            trace[padre] = {**trace.get(padre, {}), hijo: valores}
+        else:
+            trace[atributo] = valores
+    return trace
+
+
+def clonar_traza(trace, valor, color):
+    # El valor del grupo aparece en el nombre, la leyenda y el texto emergente de la traza
+    anterior = str(trace.get('name'))
+    trace = {**trace, 'name': valor, 'legendgroup': valor, 'marker': {**trace.get('marker', {}), 'color': color}}
+    if 'offsetgroup' in trace:
+        trace['offsetgroup'] = valor
+    if 'hovertemplate' in trace:
+        trace['hovertemplate'] = trace['hovertemplate'].replace(f"={anterior}<br>", f"={valor}<br>", 1)
+    return trace
+
+
+# Precalentado de los filtros por continente: una variante filtrada cuesta
+# unos milisegundos (filtrar el snapshot y parchear la figura sin filtro), y
+# tras cada recarga se construyen en segundo plano las de cada continente
+# para que un clic en la tarta se sirva directamente desde la caché
+_precalentado = {'version': None}
+_precalentado_lock = threading.Lock()
+
+def programar_precalentado():
+    if not DASHBOARD_PREWARM_FILTERS:
+        return
+    version = snapshot.snapshot.current_version()
+    with _precalentado_lock:
+        if _precalentado['version'] == version:
+            return
+        _precalentado['version'] = version
+    threading.Thread(target=precalentar_filtros, name='dashboard-prewarm', daemon=True).start()
+
+
+def precalentar_figuras():
+    """Construye ahora las figuras sin filtro y, si está activado, las de cada continente."""
+    for chart_id in GRAFICOS:
+        figura(chart_id, None)
+    with _precalentado_lock:
+        _precalentado['version'] = snapshot.snapshot.current_version()
+    if DASHBOARD_PREWARM_FILTERS:
+        precalentar_filtros()
+
+
+def precalentar_filtros():
+    start = time.perf_counter()
+    try:
+        continents = snapshot.snapshot.get('country')['Continent'].dropna().unique()
+        for continent in continents:
+            for chart_id in GRAFICOS:
+                figura(chart_id, {'continents': [str(continent)]})
+    except Exception as e:
+        logger.warning("Error al precalentar las figuras filtradas: %s", e)
+        return
+    logger.info("Figuras de %d continentes precalentadas en %.0f ms", len(continents), (time.perf_counter() - start) * 1000)
+
+
+def titulo_vacio(filtro, error):
+    # Sin filas con un filtro activo no es un error de carga
+    return 'Sin datos para el filtro seleccionado' if filtro else error
+
+
+# Actualiza el filtro cruzado con los clics y selecciones de la tarta y el mapa
+@callback(
+    Output('dashboard-filter', 'data'),
+    Output('dashboard-filter-status', 'children'),
+    Input('graph-pop-continent-pie', 'clickData'),
+    Input('graph-gnp-choropleth', 'clickData'),
+    Input('graph-gnp-choropleth', 'selectedData'),
+    Input('dashboard-filter-reset', 'n_clicks'),
+    State('dashboard-filter', 'data'),
+    prevent_initial_call=True
+)
+def actualizar_filtro(pie_click, map_click, map_selection, _, filtro):
+    filtro = dict(filtro or {})
+    trigger = ctx.triggered_id
+    if trigger == 'dashboard-filter-reset':
+        filtro = {}
+    elif trigger == 'graph-pop-continent-pie' and pie_click:
+        continent = pie_click['points'][0].get('label')
+        # Un segundo clic sobre el mismo continente lo quita
+        filtro['continents'] = [] if filtro.get('continents') == [continent] else [continent]
+    elif trigger == 'graph-gnp-choropleth':
+        prop = ctx.triggered[0]['prop_id'].split('.')[-1]
+        if prop == 'selectedData':
+            points = (map_selection or {}).get('points', [])
+            filtro['codes'] = sorted({point['location'] for point in points if point.get('location')})
+        elif map_click:
+            code = map_click['points'][0].get('location')
+            codes = set(filtro.get('codes') or [])
+            codes.symmetric_difference_update({code} if code else set())
+            filtro['codes'] = sorted(codes)
+    filtro = {dim: values for dim, values in filtro.items() if values}
+    return filtro, descripcion_filtro(filtro)
+
+
+def descripcion_filtro(filtro):
+    if not filtro:
+        return "Sin filtros: se muestran todos los países."
+    parts = []
+    if filtro.get('continents'):
+        parts.append("Continente: " + ", ".join(filtro['continents']))
+    if filtro.get('codes'):
+        codes = filtro['codes']
+        parts.append(f"Países ({len(codes)}): " + ", ".join(codes[:10]) + ("…" if len(codes) > 10 else ""))
+    return "Filtro activo — " + " · ".join(parts)
+
 
 # Callback Mapa GNP
-@callback(Output('graph-gnp-choropleth', 'figure'), Input('graph-gnp-choropleth', 'id'))
-def cargar_gnp_mapa(_):
-    query = 'SELECT Code, Name, GNP FROM country WHERE GNP IS NOT NULL AND GNP > 0;'
-    df = fetch_data(query)
-    if df.empty: return px.choropleth(title='Error al cargar datos de GNP')
+def datos_gnp_mapa(chart_id, filtro):
+    df = snapshot.gnp_por_pais(filtro)
+    return limit_rows(df, 'GNP', ['Code', 'Name', 'GNP'], budget_for(chart_id)) if not df.empty else df
+
+@grafico('graph-gnp-choropleth', datos_gnp_mapa, ignore=('codes',),
+         trazas={'locations': 'Code', 'z': 'GNP', 'hovertext': 'Name'})
+def cargar_gnp_mapa(df, filtro):
+    if df.empty: return px.choropleth(title=titulo_vacio(filtro, 'Error al cargar datos de GNP'))
     fig = px.choropleth(df,
                         locations='Code',
                         color='GNP',
@@ -87,12 +307,14 @@ def cargar_gnp_mapa(_):
     return fig
 
 # Callback top 15 paises
-@callback(Output('graph-top-countries', 'figure'), Input('graph-top-countries', 'id'))
-def cargar_top_paises(_):
-    query = 'SELECT Name, Population, Continent FROM country ORDER BY Population DESC LIMIT 15;'
-    df = fetch_data(query)
-    if df.empty: return px.bar(title='Error al cargar los datos de los paises')
-    fig = px.bar(df.sort_values('Population', ascending=True),
+def datos_top_paises(chart_id, filtro):
+    df = snapshot.top_paises_por_poblacion(15, filtro)
+    return df.sort_values('Population', ascending=True) if not df.empty else df
+
+@grafico('graph-top-countries', datos_top_paises, trazas={'x': 'Population', 'y': 'Name'}, grupo='Continent')
+def cargar_top_paises(df, filtro):
+    if df.empty: return px.bar(title=titulo_vacio(filtro, 'Error al cargar los datos de los paises'))
+    fig = px.bar(df,
                  x='Population', y='Name', orientation='h',
                  labels={'Population': 'Población', 'Name': 'País'}, color='Continent', height=400)
     fig.update_layout(
@@ -106,11 +328,13 @@ def cargar_top_paises(_):
     return fig
 
 # población por continente
-@callback(Output('graph-pop-continent-pie', 'figure'), Input('graph-pop-continent-pie', 'id'))
-def cargar_poblacion_por_continente(_):
-    query = 'SELECT Continent, SUM(Population) as TotalPopulation FROM country GROUP BY Continent ORDER BY TotalPopulation DESC;'
-    df = fetch_data(query)
-    if df.empty: return px.pie(title='Error al cargar datos de población')
+def datos_poblacion_por_continente(chart_id, filtro):
+    return snapshot.poblacion_por_continente(filtro)
+
+@grafico('graph-pop-continent-pie', datos_poblacion_por_continente, ignore=('continents',),
+         trazas={'labels': 'Continent', 'values': 'TotalPopulation'})
+def cargar_poblacion_por_continente(df, filtro):
+    if df.empty: return px.pie(title=titulo_vacio(filtro, 'Error al cargar datos de población'))
     fig = px.pie(df, values='TotalPopulation', names='Continent', hole=0.3)
     fig.update_traces(textposition='inside', textinfo='percent+label')
     fig.update_layout(
@@ -125,12 +349,15 @@ def cargar_poblacion_por_continente(_):
     return fig
 
 # top 10 de ciudades por población
-@callback(Output('graph-top-cities', 'figure'), Input('graph-top-cities', 'id'))
-def cargar_top_paises(_):
-    query = 'SELECT Name, Population, CountryCode FROM city ORDER BY Population DESC LIMIT 10;'
-    df = fetch_data(query)
-    if df.empty: return px.bar(title='Error al cargar los datos de las ciudades')
-    fig = px.bar(df.sort_values('Population', ascending=True),
+def datos_top_ciudades(chart_id, filtro):
+    df = snapshot.top_ciudades_por_poblacion(10, filtro)
+    return df.sort_values('Population', ascending=True) if not df.empty else df
+
+@grafico('graph-top-cities', datos_top_ciudades, tables=('city',),
+         trazas={'x': 'Population', 'y': 'Name'}, grupo='CountryCode')
+def cargar_top_ciudades(df, filtro):
+    if df.empty: return px.bar(title=titulo_vacio(filtro, 'Error al cargar los datos de las ciudades'))
+    fig = px.bar(df,
                  x='Population', y='Name', orientation='h',
                  labels={'Population': 'Población', 'Name': 'Ciudad'}, color='CountryCode', height=380)
     fig.update_layout(
@@ -145,20 +372,15 @@ def cargar_top_paises(_):
     return fig
 
 # top 10 distribución de idiomas
-@callback(Output('graph-language-dist', 'figure'), Input('graph-language-dist', 'id'))
-def cargar_distribucion_idiomas(_):
-    query = '''
-    SELECT Language, SUM(Percentage)/100 * SUM(c.Population/1000000) AS WeightedSpeakersM
-    FROM countrylanguage cl
-    JOIN country c ON cl.CountryCode = c.code
-    WHERE cl.Percentage > 0
-    GROUP BY Language
-    ORDER BY WeightedSpeakersM DESC
-    LIMIT 10;
-    '''
-    df = fetch_data(query)
-    if df.empty: return px.bar(title='Error al cargar datos de idiomas')
-    fig = px.bar(df.sort_values('WeightedSpeakersM', ascending=True),
+def datos_distribucion_idiomas(chart_id, filtro):
+    df = snapshot.distribucion_idiomas(10, filtro)
+    return df.sort_values('WeightedSpeakersM', ascending=True) if not df.empty else df
+
+@grafico('graph-language-dist', datos_distribucion_idiomas, tables=('countrylanguage', 'country'),
+         trazas={'x': 'WeightedSpeakersM', 'y': 'Language'})
+def cargar_distribucion_idiomas(df, filtro):
+    if df.empty: return px.bar(title=titulo_vacio(filtro, 'Error al cargar datos de idiomas'))
+    fig = px.bar(df,
                  x='WeightedSpeakersM', y='Language', orientation='h',
                  labels={'WeightedSpeakersM': 'Hablantes Estimados (M)', 'Language': 'Idioma'}, height=380)
     fig.update_layout(
@@ -172,17 +394,28 @@ def cargar_distribucion_idiomas(_):
     return fig
 
 #  Esperanza de vida versus GNP
-@callback(Output('graph-lifeexp-vs-gnp', 'figure'), Input('graph-lifeexp-vs-gnp', 'id'))
-def cargar_esperanza_vida_vs_gnp(_):
-    query = '''
-    SELECT Name, LifeExpectancy, GNP, Population, Continent
-    FROM country
-    WHERE LifeExpectancy IS NOT NULL AND GNP IS NOT NULL AND GNP > 0 AND Population > 0;
-    '''
-    df = fetch_data(query)
-    if df.empty: return px.scatter(title='Error al cargar datos Esperanza de vida/GNP')
+TAMANO_MAXIMO = 60  # diámetro en px del punto de mayor población
+
+def datos_esperanza_vida_vs_gnp(chart_id, filtro):
+    df = snapshot.esperanza_vida_vs_gnp(filtro)
+    if df.empty: return df
+    # Con muchos puntos se agrupan en celdas (tamaño = población sumada de la celda)
+    return reduce_scatter(df, 'GNP', 'LifeExpectancy', budget_for(chart_id), group='Continent',
+                          size='Population', label='Name', log_x=True)
+
+def escala_tamanos(fig, df):
+    # Como plotly.express: el punto de mayor población del filtro mide TAMANO_MAXIMO
+    sizeref = df['Population'].max() / TAMANO_MAXIMO ** 2
+    for trace in fig['data']:
+        trace['marker'] = {**trace.get('marker', {}), 'sizeref': sizeref}
+
+@grafico('graph-lifeexp-vs-gnp', datos_esperanza_vida_vs_gnp,
+         trazas={'x': 'GNP', 'y': 'LifeExpectancy', 'marker.size': 'Population', 'hovertext': 'Name'},
+         grupo='Continent', ajustar=escala_tamanos)
+def cargar_esperanza_vida_vs_gnp(df, filtro):
+    if df.empty: return px.scatter(title=titulo_vacio(filtro, 'Error al cargar datos Esperanza de vida/GNP'))
     fig = px.scatter(df, x='GNP', y='LifeExpectancy', size='Population', color='Continent',
-                     hover_name='Name', log_x=True, size_max=60,
+                     hover_name='Name', log_x=True, size_max=TAMANO_MAXIMO,
                      labels={'GNP': 'GNP (USD, log)', 'LifeExpectancy': 'Esperanza de Vida (años)'})
     fig.update_layout(
         title_x=0.5,
@@ -195,12 +428,20 @@ def cargar_esperanza_vida_vs_gnp(_):
     return fig
 
 # Formas de Gobierno
-@callback(Output('graph-govform-dist', 'figure'), Input('graph-govform-dist', 'id'))
-def cargar_forma_govierno_distribucion(_):
-    query = 'SELECT GovernmentForm, COUNT(*) as Count FROM country GROUP BY GovernmentForm ORDER BY Count DESC LIMIT 15;'
-    df = fetch_data(query)
-    if df.empty: return px.bar(title='Error al cargar formas de govierno')
-    fig = px.bar(df.sort_values('Count', ascending=False),
+TOP_FORMAS_GOBIERNO = 15  # barras propias antes de "Otros"
+
+def datos_formas_gobierno(chart_id, filtro):
+    df = snapshot.formas_gobierno(filtro)
+    if df.empty: return df
+    # Top 15 y "Otros" con el resto real; el presupuesto solo puede dejar menos barras
+    df = top_n_with_other(df, 'GovernmentForm', 'Count', budget_for(chart_id), keep=TOP_FORMAS_GOBIERNO)
+    # Ya viene de mayor a menor (value_counts) con "Otros" al final
+    return df
+
+@grafico('graph-govform-dist', datos_formas_gobierno, trazas={'x': 'GovernmentForm', 'y': 'Count'})
+def cargar_forma_govierno_distribucion(df, filtro):
+    if df.empty: return px.bar(title=titulo_vacio(filtro, 'Error al cargar formas de govierno'))
+    fig = px.bar(df,
                  x= 'GovernmentForm', y='Count',
                  labels={'Count': 'Nº Paises', 'GovernmentForm': 'Forma de Gobierno'}, height=400)
     fig.update_layout(
@@ -214,12 +455,14 @@ def cargar_forma_govierno_distribucion(_):
     return fig
 
 # Superficie por continente
-@callback(Output('graph-surface-continent', 'figure'), Input('graph-surface-continent', 'id'))
-def cargar_superficie_por_continente(_):
-    query = 'SELECT Continent, SUM(SurfaceArea) as TotalSurface FROM country GROUP BY Continent ORDER BY TotalSurface DESC;'
-    df = fetch_data(query)
-    if df.empty: return px.bar(title='Error al cargar datos de superficie')
-    fig = px.bar(df.sort_values('TotalSurface', ascending=False),
+def datos_superficie_por_continente(chart_id, filtro):
+    df = snapshot.superficie_por_continente(filtro)
+    return df.sort_values('TotalSurface', ascending=False) if not df.empty else df
+
+@grafico('graph-surface-continent', datos_superficie_por_continente, trazas={'x': 'Continent', 'y': 'TotalSurface'})
+def cargar_superficie_por_continente(df, filtro):
+    if df.empty: return px.bar(title=titulo_vacio(filtro, 'Error al cargar datos de superficie'))
+    fig = px.bar(df,
                  x='Continent', y='TotalSurface',
                  labels={'TotalSurface': 'Superficie (Km²)', 'Continent': 'Continente'}, height=400)
     fig.update_layout(
@@ -1,15 +1,25 @@
 import dash
-from dash import dcc, html, dash_table, callback, Input, Output, State
-from db_utils import fetch_data, get_table_names, get_table_columns, parse_filter_query_named_params
+import logging
+from urllib.parse import quote, urlencode
+from dash import html, dash_table, callback, Input, Output, State, MATCH
+from db_utils import QUERY_TIMEOUT, schema_catalog, parse_filter_query_named_params, frame_to_records, query_executor
+from pagination import paginator, row_counter
+from filter_compiler import column_kind
+from export import parquet_available
 
 dash.register_page(__name__, path='/', name='Tablas Detalladas')
 
+logger = logging.getLogger(__name__)
+
 PAGE_SIZE = 15 # limite de datos mostrados por tabla
+PARQUET_EXPORT = parquet_available() # sin pyarrow no se ofrece la descarga en Parquet
 
 # Generación Dinámica del Layout
 def create_dynamic_layout():
 
-    table_names = get_table_names()
+    # Todo el esquema sale del catálogo en memoria (sin consultas por tabla)
+    tables = schema_catalog.tables()
+    table_names = list(tables.keys())
     layout_children = [
         html.H2("Exploración Dinámica de Tablas de la Base de Datos", style={'textAlign': 'center', 'marginTop': '0', 'paddingTop': '110px'})
     ]
@@ -17,109 +27,143 @@ def create_dynamic_layout():
         layout_children.append(html.P("No se encontraron tablas o hubo error."))
         return html.Div(layout_children)
 
-    print(f"Generando layout para tablas: {table_names}")
+    logger.debug("Generando layout para tablas: %s", table_names)
+    # Cada tabla es un desplegable cerrado: la DataTable (y sus consultas de
+    # datos y conteo) solo se crea al abrirlo, así que la página cuesta lo
+    # mismo con 3 tablas que con 300
     for table_name in table_names:
-        table_columns = get_table_columns(table_name)
-        if not table_columns:
-            layout_children.append(html.H3(f"Tabla: {table_name} (Error columnas)", style={'color': 'red'}))
-            layout_children.append(html.Hr())
-            continue
-
-        dt_columns = [{'name': col, 'id': col} for col in table_columns]
-        table_id = f"dynamic-table-{table_name}"
-        count_id = f"{table_id}-row-count"
-
-        layout_children.extend([
-            html.H3(f"{table_name}", style={'text-align': 'center', 'fontSize': '20px'}),
-            dash_table.DataTable(
-                id=table_id,
-                columns=dt_columns,
-                page_current=0, page_size=PAGE_SIZE, page_action='custom',
-                filter_action='custom', filter_query='',
-                style_table={'overflowX': 'auto', 'width': '95%', 'fontFamily': "'Roboto', sans-serif", 'margin': '10px auto'},
-                style_header={'backgroundColor': 'rgb(0, 39, 82)', 'fontWeight': 'bold', 'fontFamily': "'Roboto', sans-serif", 'color': 'white'},
-                style_cell={'minWidth': '100px', 'width': '150px', 'maxWidth': '250px',
-                            'overflow': 'hidden', 'textOverflow': 'ellipsis', 'textAlign': 'left',
-                            'whiteSpace': 'normal', 'height': 'auto', 'padding': '5px', 'fontFamily': "'Roboto', sans-serif"},
-                style_data_conditional=[{'if': {'row_index': 'odd'}, 'backgroundColor': 'rgb(248, 248, 248)'}],
-            ),
-            html.Div(id=count_id, style={'marginTop': '10px', 'fontStyle': 'italic'}),
-            html.Hr()
-        ])
+        layout_children.append(html.Details([
+            html.Summary(table_summary(table_name, tables[table_name]), className='tabla-resumen',
+                         id={'type': 'dynamic-table-summary', 'table': table_name}, n_clicks=0),
+            html.Div(id={'type': 'dynamic-table-container', 'table': table_name}),
+        ], id={'type': 'dynamic-table-details', 'table': table_name}, open=False, className='tabla-desplegable'))
     return html.Div(layout_children)
 
-layout = create_dynamic_layout
+def table_summary(table_name, table_info):
+    # Tamaño estimado del catálogo (information_schema / sqlite_stat1), sin COUNT(*)
+    if table_info.rows_estimate is None:
+        return table_name
+    return [table_name, html.Span(f" (~{table_info.rows_estimate} filas)", className='tabla-resumen-filas')]
+
+def create_table_content(table_name):
+    table_info = schema_catalog.get(table_name)
+    if table_info is None or not table_info.columns:
+        return html.H3(f"Tabla: {table_name} (Error columnas)", style={'color': 'red'})
+
+    # El tipo de columna hace que dash_table proponga '=' en numéricas y 'contains' en texto
+    column_types = table_info.types
+    dt_columns = [{'name': col, 'id': col, 'type': column_kind(column_types.get(col))} for col in table_info.columns]
+    # IDs por patrón: un único callback (MATCH) atiende a todas las tablas
+    table_id = {'type': 'dynamic-table', 'table': table_name}
+    count_id = {'type': 'dynamic-table-row-count', 'table': table_name}
+    export_id = {'type': 'dynamic-table-export', 'table': table_name}
+
+    return html.Div([
+        dash_table.DataTable(
+            id=table_id,
+            columns=dt_columns,
+            page_current=0, page_size=PAGE_SIZE, page_action='custom',
+            filter_action='custom', filter_query='',
+            # Sin esto dash_table envía 'scontains'/'s=' y las búsquedas distinguirían mayúsculas;
+            # así se comporta como la colación _ci de MariaDB y el botón Aa sigue activando 's'
+            filter_options={'case': 'insensitive'},
+            style_table={'overflowX': 'auto', 'width': '95%', 'fontFamily': "'Roboto', sans-serif", 'margin': '10px auto'},
+            style_header={'backgroundColor': 'rgb(0, 39, 82)', 'fontWeight': 'bold', 'fontFamily': "'Roboto', sans-serif", 'color': 'white'},
+            style_cell={'minWidth': '100px', 'width': '150px', 'maxWidth': '250px',
+                        'overflow': 'hidden', 'textOverflow': 'ellipsis', 'textAlign': 'left',
+                        'whiteSpace': 'normal', 'height': 'auto', 'padding': '5px', 'fontFamily': "'Roboto', sans-serif"},
+            style_data_conditional=[{'if': {'row_index': 'odd'}, 'backgroundColor': 'rgb(248, 248, 248)'}],
+        ),
+        html.Div(id=count_id, style={'marginTop': '10px', 'fontStyle': 'italic'}),
+        html.Div(export_links(table_name), id=export_id, style={'marginTop': '5px'}),
+    ])
 
-# Generación Dinámica de Callbacks
-def generate_table_callback(table_id, table_name, columns_list):
-    print(f"Definiendo callback para tabla: {table_name} (ID: {table_id})")
-
-    @dash.callback(
-        Output(table_id, 'data'),
-        Output(f'{table_id}-row-count', 'children'),
-        Input(table_id, "page_current"),
-        Input(table_id, "page_size"),
-        Input(table_id, "sort_by"),
-        Input(table_id, "filter_query")
-    )
-    def update_dynamic_table(page_current, page_size, sort_by, filter_query):
-        print(f"Callback disparado para tabla '{table_name}': page={page_current}, size={page_size}, sort={sort_by}, filter='{filter_query}'")
-        offset = page_current * page_size
-
-        # Ordenación
-        order_by_clause = f"ORDER BY `{columns_list[0]}` ASC"
-        if sort_by:
-            orders = [f"`{col['column_id']}` {col['direction'].upper()}"
-                      for col in sort_by if col['column_id'] in columns_list]
-            if orders: order_by_clause = "ORDER BY " + ", ".join(orders)
-
-        # Filtrado
-        where_clause, sql_params_dict = parse_filter_query_named_params(filter_query, columns_list)
-
-        # Query para Datos
-        safe_columns_str = ", ".join([f"`{c}`" for c in columns_list])
-        query = f"""
-            SELECT {safe_columns_str}
-            FROM `{table_name}`
-            WHERE {where_clause}
-            {order_by_clause}
-            LIMIT :limit OFFSET :offset;
-        """
-        # Crear diccionario de parámetros combinando filtro y paginación
-        params_dict_data = sql_params_dict.copy()
-        params_dict_data['limit'] = page_size
-        params_dict_data['offset'] = offset
-
-        # Llamar a fetch_data con la query y el diccionario de parámetros
-        df_page = fetch_data(query, params=params_dict_data)
-
-        # Query para Conteo
-        count_query = f"SELECT COUNT(*) as total FROM `{table_name}` WHERE {where_clause};"
-        # Llamar a fetch_data con la query de conteo y SÓLO los params del filtro
-        df_count = fetch_data(count_query, params=sql_params_dict) # Pasar params del filtro
-
-        total_rows = 0
-        if not df_count.empty:
-            try: total_rows = int(df_count['total'].iloc[0])
-            except: print(f"Error al obtener conteo para {table_name}")
-        else: print(f"Consulta de conteo vacía para {table_name}")
+layout = create_dynamic_layout
 
+# Enlaces de descarga de la tabla completa con el filtro y orden actuales
+def export_links(table_name, filter_query='', sort_by=None):
+    query_string = urlencode({
+        'filter': filter_query or '',
+        'sort': ",".join(f"{col['column_id']}:{col['direction']}" for col in sort_by or []),
+    })
+    base = f"/export/{quote(table_name)}"
+    links = [html.A("Descargar CSV", href=f"{base}.csv?{query_string}", target='_blank', className='enlace-descarga')]
+    if PARQUET_EXPORT:
+        links.append(html.A("Descargar Parquet", href=f"{base}.parquet?{query_string}", target='_blank', className='enlace-descarga'))
+    return links
+
+# Carga perezosa: la tabla se crea la primera vez que se abre su desplegable
+# (sin llamada inicial, así que abrir la página no dispara ningún callback).
+# html.Details no informa de 'open' al navegar, así que se usa el clic en
+# su Summary: el primero lo abre y los siguientes no vuelven a crear la tabla
+@callback(
+    Output({'type': 'dynamic-table-container', 'table': MATCH}, 'children'),
+    Output({'type': 'dynamic-table-details', 'table': MATCH}, 'open'),
+    Input({'type': 'dynamic-table-summary', 'table': MATCH}, 'n_clicks'),
+    State({'type': 'dynamic-table-container', 'table': MATCH}, 'children'),
+    State({'type': 'dynamic-table-summary', 'table': MATCH}, 'id'),
+    prevent_initial_call=True
+)
+def load_table_on_open(n_clicks, children, summary_id):
+    # Al cerrarlo se conserva la tabla (con su página, orden y filtro)
+    if not n_clicks or children:
+        return dash.no_update, dash.no_update
+    # 'open' acompaña al estado del navegador para que Dash no cierre el desplegable al repintarlo
+    return create_table_content(summary_id['table']), True
+
+# Callback único para todas las tablas
+# Se registra una sola vez sin importar cuántas tablas haya; la tabla se toma
+# del id del componente y sus columnas del catálogo, así que las tablas nuevas
+# funcionan sin volver a registrar callbacks.
+@callback(
+    Output({'type': 'dynamic-table', 'table': MATCH}, 'data'),
+    Output({'type': 'dynamic-table-row-count', 'table': MATCH}, 'children'),
+    Output({'type': 'dynamic-table-export', 'table': MATCH}, 'children'),
+    Input({'type': 'dynamic-table', 'table': MATCH}, "page_current"),
+    Input({'type': 'dynamic-table', 'table': MATCH}, "page_size"),
+    Input({'type': 'dynamic-table', 'table': MATCH}, "sort_by"),
+    Input({'type': 'dynamic-table', 'table': MATCH}, "filter_query"),
+    State({'type': 'dynamic-table', 'table': MATCH}, "id")
+)
+def update_dynamic_table(page_current, page_size, sort_by, filter_query, table_id):
+    table_name = table_id['table']
+    logger.debug("Callback disparado para tabla '%s'", table_name,
+                 extra={'table': table_name, 'page': page_current, 'page_size': page_size,
+                        'sort_by': sort_by, 'filter_query': filter_query})
+    # Solo se consultan tablas del catálogo (el id llega del navegador)
+    table_info = schema_catalog.get(table_name)
+    if table_info is None or not table_info.columns:
+        return [], f"Tabla '{table_name}' no encontrada", []
+    columns_list = table_info.columns
+    primary_key, nullable_columns, column_types = table_info.primary_key, table_info.nullable, table_info.types
+
+    offset = page_current * page_size
+
+    # Ordenación (la clave primaria se añade como desempate en el paginador)
+    order = [(columns_list[0], 'ASC')]
+    if sort_by:
+        # La dirección llega del navegador: solo ASC/DESC, como en la exportación
+        orders = [(col['column_id'], col['direction'].upper()) for col in sort_by
+                  if col['column_id'] in columns_list and col['direction'].upper() in ('ASC', 'DESC')]
+        if orders: order = orders
+
+    # Filtrado
+    where_clause, sql_params_dict = parse_filter_query_named_params(filter_query, columns_list, column_types)
+
+    # Conteo en paralelo con la consulta de datos (cacheado por tabla y filtro)
+    count_future = row_counter.submit(table_name, where_clause, sql_params_dict)
+
+    # Query para Datos: por clave (seek) al pasar de página, OFFSET solo en saltos arbitrarios
+    df_page = paginator.fetch_page(table_name, columns_list, primary_key, order,
+                                   where_clause, sql_params_dict, page_current, page_size, nullable_columns)
+
+    total_rows, approximate = 0, False
+    # Un COUNT(*) lento no bloquea la tabla más allá del tiempo máximo de consulta
+    try: total_rows, approximate = query_executor.result(count_future, QUERY_TIMEOUT)
+    except Exception as e: logger.warning("Error al obtener conteo para %s: %s", table_name, e)
+
+    if approximate:
+        row_count_text = f"Mostrando filas {offset + 1} a {offset + len(df_page)} de ~{total_rows}"
+    else:
         row_count_text = f"Mostrando filas {offset + 1} a {min(offset + page_size, total_rows)} de {total_rows}"
-        return df_page.to_dict('records') if not df_page.empty else [], row_count_text
-
-# Registrar Callbacks
-all_table_names_for_callbacks = get_table_names()
-if all_table_names_for_callbacks:
-    print("-" * 30)
-    print("Registrando callbacks dinámicos (estilo SQLAlchemy):")
-    for t_name in all_table_names_for_callbacks:
-        t_cols = get_table_columns(t_name)
-        if t_cols:
-            t_id = f"dynamic-table-{t_name}"
-            generate_table_callback(t_id, t_name, t_cols)
-            print(f" - Callback registrado para: {t_name}")
-        else:
-            print(f" ! Omitiendo callback para tabla '{t_name}' (sin columnas).")
-    print("-" * 30)
-else:
-    print("Advertencia: No se encontraron tablas para registrar callbacks.")
\ No newline at end of file
+    return frame_to_records(df_page), row_count_text, export_links(table_name, filter_query, sort_by)
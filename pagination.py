@@ -0,0 +1,227 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+import pandas as pd
+from db_utils import QUERY_TIMEOUT, TableGenerations, fetch_data, create_cache_backend, schema_catalog, query_executor
+import instrumentation
+
+logger = logging.getLogger(__name__)
+
+# 'keyset' (por defecto) usa predicados de búsqueda; 'offset' fuerza LIMIT/OFFSET siempre
+TABLE_PAGINATION = os.getenv('TABLE_PAGINATION', 'keyset').lower()
+MAX_CURSORS = int(os.getenv('TABLE_PAGINATION_MAX_CURSORS', '256'))
+MAX_PAGES_PER_CURSOR = 64
+
+# Conteos de filas
+COUNT_CACHE_TTL = int(os.getenv('COUNT_CACHE_TTL', '600'))
+# Tablas sin filtro con al menos estas filas estimadas muestran la estimación (~N) en vez de COUNT(*)
+COUNT_ESTIMATE_THRESHOLD = int(os.getenv('COUNT_ESTIMATE_THRESHOLD', '1000000'))
+
+
+class KeysetPaginator:
+    """
+    Paginación por clave (seek) para la página de tablas.
+
+    El orden de cada consulta es el de las columnas ordenadas más la clave
+    primaria como desempate, de forma que cada fila tiene una posición única.
+    Para cada combinación de tabla/orden/filtro/tamaño de página se
+    recuerdan la primera y la última clave de las páginas ya servidas: ir a
+    la página siguiente o anterior se resuelve con un predicado sobre esas
+    claves (coste constante sin importar la profundidad) y solo los saltos
+    arbitrarios usan OFFSET.
+    """
+    def __init__(self, max_cursors: int = MAX_CURSORS, mode: str = TABLE_PAGINATION):
+        self.max_cursors = max_cursors
+        self.mode = mode
+        self._cursors = OrderedDict()  # cursor_key -> {página: (primera_clave, última_clave)}
+        self._lock = threading.Lock()
+
+    def fetch_page(self, table_name: str, columns: list, primary_key: list, order: list,
+                   where_clause: str, params: dict, page: int, page_size: int, nullable=None) -> pd.DataFrame:
+        """
+        Devuelve la página `page` de `table_name`. `order` es una lista de
+        (columna, 'ASC'|'DESC'); se completa con la clave primaria.
+        `nullable` son las columnas que admiten NULL (None = todas).
+        """
+        order = self._complete_order(order, primary_key)
+        order_columns = [col for col, _ in order]
+        # Las claves de cada página dependen del tamaño de página
+        cursor_key = (table_name, tuple(order), where_clause, json.dumps(params, sort_keys=True, default=str), page_size)
+        boundaries = self._boundaries(cursor_key) if primary_key and self.mode == 'keyset' else {}
+
+        query_params = dict(params)
+        query_params['limit'] = page_size
+        reverse = False
+        seek_clause = None
+        if page == 0:
+            pass
+        elif page - 1 in boundaries:
+            # Página siguiente: filas posteriores a la última clave de la página anterior
+            seek_clause = self._seek_predicate(order, boundaries[page - 1][1], query_params, True, nullable)
+        elif page + 1 in boundaries:
+            # Página anterior: filas previas a la primera clave de la página siguiente, en orden inverso
+            seek_clause = self._seek_predicate(order, boundaries[page + 1][0], query_params, False, nullable)
+            reverse = seek_clause is not None
+
+        if page == 0 or seek_clause is not None:
+            offset_clause = ""
+        else:
+            offset_clause = " OFFSET :offset"
+            query_params['offset'] = page * page_size
+
+        where_parts = [where_clause]
+        if seek_clause is not None:
+            where_parts.append(seek_clause)
+        query_order = [(col, _flip(direction)) for col, direction in order] if reverse else order
+        order_by_clause = "ORDER BY " + ", ".join(f"`{col}` {direction}" for col, direction in query_order)
+        safe_columns_str = ", ".join([f"`{c}`" for c in columns])
+        query = f"""
+            SELECT {safe_columns_str}
+            FROM `{table_name}`
+            WHERE {' AND '.join(f'({part})' for part in where_parts)}
+            {order_by_clause}
+            LIMIT :limit{offset_clause};
+        """
+        df_page = fetch_data(query, params=query_params)
+        if reverse:
+            df_page = df_page.iloc[::-1].reset_index(drop=True)
+
+        if primary_key and self.mode == 'keyset' and not df_page.empty and all(c in df_page.columns for c in order_columns):
+            first_key = tuple(df_page.iloc[0][order_columns])
+            last_key = tuple(df_page.iloc[-1][order_columns])
+            self._remember(cursor_key, page, first_key, last_key)
+        return df_page
+
+    @staticmethod
+    def _complete_order(order, primary_key):
+        # La dirección se interpola en ORDER BY y decide el sentido del seek
+        invalid = [direction for _, direction in order if direction not in ('ASC', 'DESC')]
+        if invalid:
+            raise ValueError(f"Dirección de orden no válida: {invalid[0]!r}")
+        seen = {col for col, _ in order}
+        return list(order) + [(col, 'ASC') for col in primary_key or [] if col not in seen]
+
+    @staticmethod
+    def _seek_predicate(order, key, query_params, forward: bool, nullable=None):
+        """
+        Construye (c0 > k0) OR (c0 = k0 AND c1 > k1) OR ... respetando la
+        dirección de cada columna, más un rango sobre la primera columna para
+        que el optimizador pueda usar su índice. NULL se ordena como el valor
+        más pequeño (como en MariaDB); si la clave contiene NULL se devuelve
+        None y se usa OFFSET.
+        """
+        if any(pd.isna(value) for value in key):
+            return None
+        names = []
+        for i, value in enumerate(key):
+            name = f"seek_param_{i}"
+            query_params[name] = value.item() if hasattr(value, 'item') else value
+            names.append(name)
+
+        def comparison(col, direction, name, strict):
+            ascending = (direction == 'ASC') == forward
+            op = ('>' if ascending else '<') + ('' if strict else '=')
+            predicate = f"`{col}` {op} :{name}"
+            # Los NULL quedan "por debajo" de cualquier valor
+            if ascending or (nullable is not None and col not in nullable):
+                return predicate
+            return f"({predicate} OR `{col}` IS NULL)"
+
+        alternatives = []
+        for i, (col, direction) in enumerate(order):
+            equals = [f"`{order[j][0]}` = :{names[j]}" for j in range(i)]
+            alternatives.append(" AND ".join(equals + [comparison(col, direction, names[i], strict=True)]))
+        leading_range = comparison(order[0][0], order[0][1], names[0], strict=False)
+        return f"{leading_range} AND ({' OR '.join(f'({alt})' for alt in alternatives)})"
+
+    def _boundaries(self, cursor_key) -> dict:
+        with self._lock:
+            boundaries = self._cursors.get(cursor_key)
+            if boundaries is None:
+                return {}
+            self._cursors.move_to_end(cursor_key)
+            return dict(boundaries)
+
+    def _remember(self, cursor_key, page, first_key, last_key):
+        with self._lock:
+            boundaries = self._cursors.setdefault(cursor_key, {})
+            boundaries[page] = (first_key, last_key)
+            if len(boundaries) > MAX_PAGES_PER_CURSOR:
+                boundaries.pop(next(iter(boundaries)))
+            self._cursors.move_to_end(cursor_key)
+            while len(self._cursors) > self.max_cursors:
+                self._cursors.popitem(last=False)
+
+    def invalidate(self, table_name: str = None):
+        """Olvida las claves recordadas (de una tabla o de todas) cuando sus datos cambian."""
+        with self._lock:
+            if table_name is None:
+                self._cursors.clear()
+                return
+            for cursor_key in [key for key in self._cursors if key[0] == table_name]:
+                del self._cursors[cursor_key]
+
+
+def _flip(direction: str) -> str:
+    return 'DESC' if direction == 'ASC' else 'ASC'
+
+
+class RowCounter:
+    """
+    Conteo de filas de la página de tablas. Los conteos exactos se cachean por
+    (tabla, filtro), así que cambiar de página u ordenación no repite el
+    COUNT(*). Para tablas grandes sin filtro se usa la estimación de
+    information_schema que guarda el catálogo, y se muestra como aproximada.
+    submit() lanza el conteo en paralelo con la consulta de la página.
+    """
+    def __init__(self, ttl: float = COUNT_CACHE_TTL, estimate_threshold: int = COUNT_ESTIMATE_THRESHOLD):
+        self.ttl = ttl
+        self.estimate_threshold = estimate_threshold
+        self._cache = create_cache_backend('counts', max_entries=1024, max_bytes=1024 * 1024)
+        self._generations = TableGenerations()
+
+    def submit(self, table_name: str, where_clause: str, params: dict):
+        """Devuelve un Future con (total, es_aproximado)."""
+        return query_executor.submit_call(self.count, table_name, where_clause, params)
+
+    def count(self, table_name: str, where_clause: str, params: dict):
+        key = json.dumps([table_name, where_clause, params], sort_keys=True, default=str)
+        cached = self._cache.get(key)
+        instrumentation.record_cache(cached is not None)
+        if cached is not None:
+            return cached
+
+        generation = self._generations.current((table_name,))
+        result = None
+        if where_clause == "1=1":
+            table = schema_catalog.get(table_name)
+            estimate = table.rows_estimate if table else None
+            if estimate is not None and estimate >= self.estimate_threshold:
+                result = (estimate, True)
+        if result is None:
+            count_query = f"SELECT COUNT(*) as total FROM `{table_name}` WHERE {where_clause};"
+            # El resultado se cachea aquí, por eso se salta la caché general
+            df_count = fetch_data(count_query, params=params, use_cache=False, timeout=QUERY_TIMEOUT)
+            if df_count.empty:
+                logger.warning("Consulta de conteo vacía para %s", table_name)
+                return 0, False
+            result = (int(df_count['total'].iloc[0]), False)
+        # Un conteo que empezó antes de invalidar la tabla no se guarda
+        if self._generations.current((table_name,)) == generation:
+            self._cache.set(key, result, self.ttl, tables=(table_name,))
+        return result
+
+    def invalidate(self, table_name: str = None):
+        """Descarta los conteos cacheados (de una tabla o de todas)."""
+        if table_name is None:
+            self._generations.advance()
+            self._cache.clear()
+            return
+        self._generations.advance((table_name,))
+        self._cache.delete_tables((table_name,))
+
+
+paginator = KeysetPaginator()
+row_counter = RowCounter()
@@ -0,0 +1,85 @@
+"""
+Arranque en producción con varios procesos (ver gunicorn.conf.py).
+
+El proceso maestro importa la app una sola vez (preload_app), calienta las
+cachés y después crea los workers con fork, que heredan el catálogo del
+esquema, el snapshot del dashboard, las figuras y los callbacks ya
+registrados. Con CACHE_BACKEND=sqlite los resultados de consultas, los
+conteos y las figuras se comparten además entre todos los workers a través
+de un fichero local, así que lo que calcula uno lo aprovechan los demás y
+los workers nuevos de una recarga (HUP) no empiezan en frío.
+
+    gunicorn                              (lee gunicorn.conf.py del directorio actual)
+    WEB_CONCURRENCY=4 WEB_THREADS=8 gunicorn
+    kill -HUP <pid del maestro>           (datos y configuración; no recarga el código)
+    kill -USR2 <pid del maestro>          (código nuevo: arranca otro maestro...)
+    kill -QUIT <pid del maestro antiguo>  (...y después se para el anterior)
+"""
+import importlib
+import logging
+import os
+import time
+import change_detection
+import db_utils
+import instrumentation
+import snapshot
+
+logger = logging.getLogger(__name__)
+
+# Precalentar también la primera página y el conteo de cada tabla de la página de tablas
+WARM_TABLE_PAGES = os.getenv('WARM_TABLE_PAGES', 'true').lower() in ('1', 'true', 'yes')
+
+
+def warm_caches():
+    """
+    Deja cargados el catálogo, el snapshot, las figuras del dashboard (sin
+    filtro y por continente) y la primera página de cada tabla. Antes toma
+    las huellas de los datos, de modo que los cambios posteriores se detectan.
+    Cada paso que falla se registra y se salta: los workers arrancan en frío
+    y cargan lo que falte con la primera petición.
+    """
+    if db_utils.engine is None:
+        logger.error("Sin conexión a la base de datos: se arranca sin precalentar")
+        return
+    start = time.perf_counter()
+    _paso("tomar las huellas de los datos", change_detection.change_detector.poll)
+    tables = _paso("cargar el catálogo del esquema", db_utils.schema_catalog.tables) or []
+    _paso("cargar el snapshot", snapshot.snapshot.get, 'country')
+    _paso("precalentar las figuras del dashboard",
+          lambda: importlib.import_module('pages.dashboard').precalentar_figuras())
+    if WARM_TABLE_PAGES:
+        tables_page = _paso("importar la página de tablas", importlib.import_module, 'pages.tables')
+        for table_name in tables if tables_page is not None else []:
+            table_id = {'type': 'dynamic-table', 'table': table_name}
+            _paso(f"precalentar la tabla {table_name}", tables_page.update_dynamic_table,
+                  0, tables_page.PAGE_SIZE, None, '', table_id)
+    logger.info("Cachés precalentadas en %.0f ms (%d tablas)", (time.perf_counter() - start) * 1000, len(tables))
+
+
+def prepare_master():
+    """
+    Maestro, antes de crear workers (al arrancar y en cada HUP): calienta las
+    cachés y detiene sus hilos de fondo para que ningún hilo esté a medias
+    durante el fork; cada worker arranca los suyos en after_fork(). No lanza
+    excepciones: un error aquí tumbaría el maestro de gunicorn.
+    """
+    _paso("precalentar las cachés", warm_caches)
+    _paso("detener el detector de cambios", change_detection.change_detector.stop, wait=True)
+    _paso("detener el refresco del snapshot", snapshot.snapshot.stop_scheduler)
+
+
+def _paso(description: str, func, *args, **kwargs):
+    """Ejecuta un paso del arranque; si falla lo registra y devuelve None."""
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        logger.exception("Error al %s; se continúa sin él", description)
+        return None
+
+
+def after_fork():
+    """Worker recién creado: conexiones, hilos y logging propios; los datos heredados se conservan."""
+    db_utils.reset_after_fork()
+    instrumentation.reset_after_fork()
+    change_detection.change_detector.reset_after_fork()
+    logger.info("Worker %d listo", os.getpid())
@@ -0,0 +1,282 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import db_utils
+
+logger = logging.getLogger(__name__)
+
+# Segundos entre recargas automáticas del snapshot (0 desactiva la recarga programada)
+SNAPSHOT_REFRESH_SECONDS = int(os.getenv('SNAPSHOT_REFRESH_SECONDS', '600'))
+
+# Columnas de cada tabla que necesitan los gráficos del dashboard
+SNAPSHOT_QUERIES = {
+    'country': 'SELECT Code, Name, Continent, SurfaceArea, Population, LifeExpectancy, GNP, GovernmentForm FROM country;',
+    'city': 'SELECT Name, CountryCode, Population FROM city;',
+    'countrylanguage': 'SELECT CountryCode, Language, Percentage FROM countrylanguage;',
+}
+
+# Columnas DECIMAL que llegan como objetos Decimal y se pasan a float64
+NUMERIC_COLUMNS = {
+    'country': ['SurfaceArea', 'Population', 'LifeExpectancy', 'GNP'],
+    'city': ['Population'],
+    'countrylanguage': ['Percentage'],
+}
+
+# Columnas por las que filtra el dashboard: se precalculan sus posiciones por valor
+INDEXED_COLUMNS = {
+    'country': ['Continent', 'Code'],
+    'city': ['CountryCode'],
+    'countrylanguage': ['CountryCode'],
+}
+# Dimensiones del filtro cruzado del dashboard (claves del dcc.Store)
+FILTER_DIMENSIONS = ('continents', 'codes')
+MAX_FILTERED_CODES = 128
+
+
+class DashboardSnapshot:
+    """
+    Copia en memoria de las tablas country, city y countrylanguage.
+    Se carga una sola vez (las tres consultas en paralelo), se recarga cada
+    SNAPSHOT_REFRESH_SECONDS o bajo demanda con refresh(), y todos los
+    gráficos del dashboard se calculan sobre ella con group-bys de pandas.
+    Cada tabla lleva su propia versión para que refresh(tables) recargue solo
+    las que cambiaron y los gráficos que no dependen de ellas sigan cacheados.
+    Esa versión es una huella del contenido, así que es la misma en todos los
+    procesos que tengan los mismos datos (la caché de figuras compartida la
+    usa como clave) y no cambia si una recarga trae datos idénticos.
+    Al cargar cada tabla se agrupan las posiciones de sus filas por las
+    columnas de INDEXED_COLUMNS, así que filtrar por continente o país es
+    tomar esas posiciones (select) sin recorrer la tabla.
+    """
+    def __init__(self, refresh_seconds: int = SNAPSHOT_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.frames = {}
+        self.indexes = {}  # tabla -> columna -> {valor: posiciones}
+        self.version = 0  # se incrementa en cada recarga correcta
+        self.table_versions = {name: 0 for name in SNAPSHOT_QUERIES}  # recargas de cada tabla
+        self.table_signatures = {}  # tabla -> huella del contenido
+        self.loaded_at = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._scheduler = None
+        self._stop = threading.Event()
+        self._generations = db_utils.TableGenerations()
+
+    def refresh(self, tables=None) -> bool:
+        """Recarga las tablas (todas o solo `tables`). Si falla, se conserva el snapshot anterior."""
+        if db_utils.engine is None:
+            logger.error("El engine de SQLAlchemy no está inicializado.")
+            return False
+        try:
+            # Las tres tablas se cargan en paralelo: el tiempo en frío es el de la más lenta
+            names = [name for name in (tables or SNAPSHOT_QUERIES) if name in SNAPSHOT_QUERIES]
+            if self.frames and not names:
+                return True
+            if not self.frames:
+                names = list(SNAPSHOT_QUERIES)
+            # Cada recarga invalida las que ya estaban en curso para esas tablas
+            self._generations.advance(names)
+            started = {name: self._generations.current((name,)) for name in names}
+            frames = db_utils.query_executor.fetch_many({name: SNAPSHOT_QUERIES[name] for name in names})
+            for name, df in frames.items():
+                for col in NUMERIC_COLUMNS.get(name, []):
+                    df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+            indexes = {name: {col: df.groupby(col, observed=True, sort=False).indices
+                              for col in INDEXED_COLUMNS.get(name, []) if col in df.columns}
+                       for name, df in frames.items()}
+            signatures = {name: _signature(df) for name, df in frames.items()}
+        except Exception as e:
+            logger.error("Error al cargar el snapshot del dashboard: %s", e)
+            return False
+        with self._lock:
+            # Una recarga más reciente de la misma tabla ya empezó: sus datos pueden ser anteriores
+            frames = {name: df for name, df in frames.items() if self._generations.current((name,)) == started[name]}
+            if not frames:
+                return True
+            self.frames = {**self.frames, **frames}
+            self.indexes = {**self.indexes, **{name: indexes[name] for name in frames}}
+            self.table_signatures = {**self.table_signatures, **{name: signatures[name] for name in frames}}
+            for name in frames:
+                self.table_versions[name] += 1
+            self.version += 1
+            self.loaded_at = time.time()
+        logger.info("Snapshot del dashboard cargado (versión %d, tablas %s)", self.version, ", ".join(frames))
+        return True
+
+    def get(self, table_name: str) -> pd.DataFrame:
+        """Devuelve la tabla del snapshot, cargándolo la primera vez."""
+        if not self.frames:
+            with self._load_lock:
+                if not self.frames:  # otro hilo pudo cargarlo mientras esperábamos
+                    self.refresh()
+        self._ensure_scheduler()
+        return self.frames.get(table_name, pd.DataFrame())
+
+    def select(self, table_name: str, column: str, values) -> pd.DataFrame:
+        """Filas de `table_name` cuyo `column` está en `values`, en el orden original de la tabla."""
+        self.get(table_name)
+        with self._lock:
+            frame = self.frames.get(table_name, pd.DataFrame())
+            index = self.indexes.get(table_name, {}).get(column)
+        if index is None:
+            return frame.loc[frame[column].isin(values)]
+        positions = [index[value] for value in values if value in index]
+        if not positions:
+            return frame.iloc[0:0]
+        return frame.take(np.sort(np.concatenate(positions)))
+
+    def current_version(self, tables=None):
+        """
+        Versión de los datos cargados (carga el snapshot si aún no existe).
+        Con `tables` devuelve la tupla de huellas de esas tablas, que solo
+        cambia cuando cambian sus datos.
+        """
+        self.get('country')
+        if tables is None:
+            return self.version
+        return tuple(self.table_signatures.get(name, '') for name in tables)
+
+    def stop_scheduler(self):
+        """Detiene la recarga programada (se vuelve a arrancar con el siguiente get())."""
+        self._stop.set()
+        scheduler = self._scheduler
+        if scheduler is not None and scheduler.is_alive():
+            scheduler.join()
+
+    def _ensure_scheduler(self):
+        if self.refresh_seconds <= 0 or (self._scheduler is not None and self._scheduler.is_alive()):
+            return
+        with self._lock:
+            if self._scheduler is not None and self._scheduler.is_alive():
+                return
+            self._stop.clear()
+            self._scheduler = threading.Thread(target=self._refresh_loop, name='snapshot-refresh', daemon=True)
+            self._scheduler.start()
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_seconds):
+            self.refresh()
+
+
+def _signature(df: pd.DataFrame) -> str:
+    # Suma (módulo 2^64) de los hashes de cada fila más el número de filas
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return f"{len(df):x}-{int(row_hashes.sum(dtype=np.uint64)):016x}"
+
+
+snapshot = DashboardSnapshot()
+
+
+# Filtro cruzado del dashboard
+
+def filter_key(filtro, ignore=()):
+    """
+    Forma canónica (hashable) del filtro del dcc.Store, sin las dimensiones de
+    `ignore` (el gráfico que origina un filtro no se filtra a sí mismo).
+    None si no queda ningún filtro activo.
+    """
+    filtro = filtro or {}
+    key = tuple(tuple(sorted(filtro.get(dim) or ())) if dim not in ignore else () for dim in FILTER_DIMENSIONS)
+    return key if any(key) else None
+
+
+_filtered_codes = OrderedDict()
+_filtered_codes_lock = threading.Lock()
+
+
+def filtered_codes(filtro) -> list:
+    """Códigos de país que cumplen el filtro (clave de filter_key), memorizados por versión de country."""
+    memo_key = (snapshot.current_version(('country',)), filtro)
+    with _filtered_codes_lock:
+        if memo_key in _filtered_codes:
+            _filtered_codes.move_to_end(memo_key)
+            return _filtered_codes[memo_key]
+    continents, codes = filtro
+    if continents:
+        selected = snapshot.select('country', 'Continent', continents)['Code'].tolist()
+        if codes:
+            wanted = set(codes)
+            selected = [code for code in selected if code in wanted]
+    else:
+        selected = list(codes)
+    with _filtered_codes_lock:
+        _filtered_codes[memo_key] = selected
+        while len(_filtered_codes) > MAX_FILTERED_CODES:
+            _filtered_codes.popitem(last=False)
+    return selected
+
+
+def filtered(table_name: str, filtro=None) -> pd.DataFrame:
+    """Tabla del snapshot restringida a los países del filtro (toda la tabla si no hay filtro)."""
+    if filtro is None:
+        return snapshot.get(table_name)
+    column = 'Code' if table_name == 'country' else 'CountryCode'
+    return snapshot.select(table_name, column, filtered_codes(filtro))
+
+
+# Datos de cada gráfico calculados sobre el snapshot
+
+def gnp_por_pais(filtro=None) -> pd.DataFrame:
+    country = filtered('country', filtro)
+    if country.empty: return country
+    return country.loc[country['GNP'] > 0, ['Code', 'Name', 'GNP']]
+
+
+def top_paises_por_poblacion(n: int = 15, filtro=None) -> pd.DataFrame:
+    country = filtered('country', filtro)
+    if country.empty: return country
+    return country.nlargest(n, 'Population')[['Name', 'Population', 'Continent']]
+
+
+def poblacion_por_continente(filtro=None) -> pd.DataFrame:
+    country = filtered('country', filtro)
+    if country.empty: return country
+    df = country.groupby('Continent', observed=True, as_index=False)['Population'].sum()
+    return df.rename(columns={'Population': 'TotalPopulation'}).sort_values('TotalPopulation', ascending=False)
+
+
+def top_ciudades_por_poblacion(n: int = 10, filtro=None) -> pd.DataFrame:
+    city = filtered('city', filtro)
+    if city.empty: return city
+    return city.nlargest(n, 'Population')[['Name', 'Population', 'CountryCode']]
+
+
+def distribucion_idiomas(n: int = 10, filtro=None) -> pd.DataFrame:
+    languages = filtered('countrylanguage', filtro)
+    country = filtered('country', filtro)
+    if languages.empty or country.empty: return pd.DataFrame()
+    df = languages.loc[languages['Percentage'] > 0].merge(
+        country[['Code', 'Population']], left_on='CountryCode', right_on='Code')
+    # Misma fórmula que la consulta original: SUM(Percentage)/100 * SUM(Population/1000000)
+    df['PopulationM'] = df['Population'] / 1_000_000
+    grouped = df.groupby('Language', observed=True).agg(Percentage=('Percentage', 'sum'), PopulationM=('PopulationM', 'sum'))
+    grouped['WeightedSpeakersM'] = grouped['Percentage'] / 100 * grouped['PopulationM']
+    return grouped['WeightedSpeakersM'].nlargest(n).reset_index()
+
+
+def esperanza_vida_vs_gnp(filtro=None) -> pd.DataFrame:
+    country = filtered('country', filtro)
+    if country.empty: return country
+    mask = country['LifeExpectancy'].notna() & (country['GNP'] > 0) & (country['Population'] > 0)
+    return country.loc[mask, ['Name', 'LifeExpectancy', 'GNP', 'Population', 'Continent']]
+
+
+def formas_gobierno(filtro=None) -> pd.DataFrame:
+    country = filtered('country', filtro)
+    if country.empty: return country
+    # GovernmentForm es categórica: con filtro, value_counts incluiría las formas sin países
+    counts = country['GovernmentForm'].value_counts()
+    # Todas las formas: el gráfico se queda con las primeras y suma el resto en "Otros"
+    counts = counts[counts > 0]
+    return counts.rename_axis('GovernmentForm').reset_index(name='Count')
+
+
+def superficie_por_continente(filtro=None) -> pd.DataFrame:
+    country = filtered('country', filtro)
+    if country.empty: return country
+    df = country.groupby('Continent', observed=True, as_index=False)['SurfaceArea'].sum()
+    return df.rename(columns={'SurfaceArea': 'TotalSurface'}).sort_values('TotalSurface', ascending=False)